@@ -6,13 +6,26 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datetime import datetime, timedelta
 import warnings
+import functools
 import io
 import requests
 import json
+import time
 from typing import Dict, List, Optional, Tuple
 import re
 import os
 
+from qts_ingest import (
+    FINGERPRINT_COLUMN, IngestCache, align_frames, drop_duplicate_rows, load_schema_mapping, quarter_labels,
+    without_fingerprints
+)
+from qts_store import FeedbackStore
+from qts_processor import FeedbackProcessor
+from qts_ai import HealthCheck, ResponseCache, read_openai_stream, stream_concurrently, timing_summary
+from qts_aggregates import (
+    SATISFACTION_BANDS, cube_mean, filter_quarters, group_slices, merge_kpis, rollup, satisfaction_band
+)
+
 # OpenAI import with version checking
 try:
     from openai import OpenAI
@@ -96,12 +109,12 @@ TRAINER_COLORS = {
 BRAND_COLOR = '#2E5090'
 ACCENT_COLORS = ['#2E5090', '#D4A574', '#7CB342', '#E57373', '#6C63B6', '#FF8A80', '#4A90E2', '#26C6DA', '#AB47BC', '#EC407A']
 
+# Trainer badge of each SATISFACTION_BANDS band, so badges, the donut and NPS share one set of thresholds
 PERFORMANCE_LEVELS = {
-    4.7: ('Outstanding', '#10b981'),
-    4.3: ('Excellent', '#2E5090'),
-    4.0: ('Very Good', '#3b82f6'),
-    3.5: ('Good', '#f59e0b'),
-    0.0: ('Needs Improvement', '#ef4444')
+    'promoters': ('Outstanding', '#10b981'),
+    'excellent': ('Excellent', '#2E5090'),
+    'good': ('Good', '#f59e0b'),
+    'needs_improvement': ('Needs Improvement', '#ef4444')
 }
 
 DATE_FORMATS = [
@@ -109,6 +122,58 @@ DATE_FORMATS = [
     '%Y/%m/%d', '%d/%m/%y', '%y-%m-%d', '%m/%d/%y'
 ]
 
+# Overall course rating column
+RATING_COLUMN = 'Please give the course a rating out of 5'
+
+# Trainer card sub-metrics and the header keywords that identify them
+METRIC_KEYWORDS = {
+    'knowledge': ['knowledge'],
+    'adaptability': ['adaptability'],
+    'feedback': ['feedback'],
+    'guidance': ['guidance']
+}
+
+# Optional JSON file mapping column roles to header names (see load_schema_mapping)
+SCHEMA_MAP_PATH = os.getenv('QTS_SCHEMA_MAP', '')
+
+# First month of the reporting year (1 = calendar quarters, 4 = April fiscal year)
+FISCAL_YEAR_START_MONTH = int(os.getenv('QTS_FISCAL_YEAR_START_MONTH', '1'))
+
+# Worker processes used to parse uploaded workbooks (0 = one per CPU core)
+INGEST_WORKERS = int(os.getenv('QTS_INGEST_WORKERS', '0'))
+
+# Uploads smaller than this in total are parsed in this process; worker start-up would cost more
+PARALLEL_INGEST_MIN_MB = float(os.getenv('QTS_PARALLEL_INGEST_MIN_MB', '8'))
+
+# On-disk Parquet cache of parsed workbooks, keyed by file content
+INGEST_CACHE_DIR = os.getenv('QTS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'qts_analytics', 'ingest'))
+INGEST_CACHE_MB = int(os.getenv('QTS_INGEST_CACHE_MB', '512'))
+
+# Workbooks at least this large are streamed read-only in bounded chunks
+STREAMING_MIN_MB = float(os.getenv('QTS_STREAMING_MIN_MB', '25'))
+STREAM_CHUNK_ROWS = 50_000
+
+# Set QTS_STORE_DIR to keep processed data between sessions. Off by default: everyone using this
+# server shares the one store, and stored data is only loaded when a user asks for it
+FEEDBACK_STORE_DIR = os.getenv('QTS_STORE_DIR', '')
+
+# KPI and chart results kept across reruns and sessions, keyed by dataset and quarter filter
+ANALYTICS_CACHE_ENTRIES = int(os.getenv('QTS_ANALYTICS_CACHE_ENTRIES', '64'))
+
+# Successful LLM responses are reused from here; set QTS_LLM_CACHE to an empty string to disable
+LLM_CACHE_PATH = os.getenv('QTS_LLM_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'qts_analytics', 'llm_responses.sqlite'))
+LLM_CACHE_TTL_HOURS = float(os.getenv('QTS_LLM_CACHE_TTL_HOURS', '168'))
+LLM_CACHE_MB = int(os.getenv('QTS_LLM_CACHE_MB', '64'))
+
+# Trainer insights requested at once
+AI_CONCURRENCY = int(os.getenv('QTS_AI_CONCURRENCY', '4'))
+
+# Stream insight tokens into their cards as they arrive (0 waits for whole answers)
+AI_STREAMING = os.getenv('QTS_AI_STREAM', '1') != '0'
+
+# Seconds a liveness probe result is trusted before it is refreshed in the background
+PROVIDER_HEALTH_TTL = float(os.getenv('QTS_PROVIDER_HEALTH_TTL', '30'))
+
 # ============================================================================
 # PAGE SETUP
 # ============================================================================
@@ -591,16 +656,16 @@ st.markdown("""
         color: #2E5090;
     }
     
-    .badge-very-good {
-        background: #FFFBEB;
-        color: #D97706;
-    }
-    
     .badge-good {
         background: #F3E8FF;
         color: #7C3AED;
     }
     
+    .badge-needs-improvement {
+        background: #FEF2F2;
+        color: #DC2626;
+    }
+    
     /* ═══════════════════════════════════════════════════════════════════ */
     /* FILE BADGES */
     /* ═══════════════════════════════════════════════════════════════════ */
@@ -826,8 +891,13 @@ class AIDataSegregator:
     @staticmethod
     def identify_file_type(df: pd.DataFrame, filename: str) -> str:
         """Uses AI-like heuristics to determine file type"""
+        return AIDataSegregator.identify_sheet_type(df.columns, len(df), filename)
+    
+    @staticmethod
+    def identify_sheet_type(columns: List, row_count: int, filename: str) -> str:
+        """Classifies a sheet from its header row and row count, before it is parsed"""
         filename_lower = filename.lower()
-        columns_lower = [str(col).lower() for col in df.columns]
+        columns_lower = [str(col).lower() for col in columns]
         
         delegate_keywords = ['delegate', 'participant', 'student', 'attendee', 'tutor', 'trainer']
         partner_keywords = ['partner', 'company', 'organization', 'client']
@@ -852,29 +922,51 @@ class AIDataSegregator:
             return 'delegate'
         elif partner_score >= 1:
             return 'partner'
-        elif len(df) > 50:
+        elif row_count > 50:
             return 'master'
         else:
             return 'delegate'
     
     @staticmethod
-    def merge_similar_files(files_dict: Dict[str, List[pd.DataFrame]]) -> Dict[str, pd.DataFrame]:
-        """Merges multiple files of the same type"""
+    def select_master_columns(columns: List) -> List:
+        """Columns of a master sheet the dashboard can use; the rest are never loaded"""
+        keywords = ['tutor', 'trainer', 'presenter', 'course', 'rating', 'date',
+                    'completion', 'submitted', 'time', 'comment', 'feedback']
+        return [col for col in columns if any(kw in str(col).lower() for kw in keywords)]
+    
+    @staticmethod
+    def merge_similar_files(files_dict: Dict[str, List[pd.DataFrame]], report: Optional[List[Dict]] = None,
+                            column_log: Optional[List[Dict]] = None) -> Dict[str, pd.DataFrame]:
+        """Merges multiple files of the same type onto one schema, dropping rows already seen in another file"""
         merged_data = {}
         
         for file_type, dfs in files_dict.items():
             if len(dfs) == 0:
                 continue
             elif len(dfs) == 1:
-                merged_data[file_type] = dfs[0]
+                merged_df, duplicates = dfs[0], [0]
             else:
                 try:
-                    merged_df = pd.concat(dfs, ignore_index=True)
-                    merged_df = merged_df.drop_duplicates()
-                    merged_data[file_type] = merged_df
+                    aligned, alignment = align_frames(dfs)
+                    merged_df, duplicates = drop_duplicate_rows(aligned)
+                    if column_log is not None:
+                        column_log.extend({'type': file_type, **entry} for entry in alignment)
                 except Exception as e:
                     st.warning(f"Error merging {file_type} files: {e}")
-                    merged_data[file_type] = dfs[0]
+                    merged_df, duplicates = dfs[0], [0] * len(dfs)
+            
+            if file_type != 'delegate' and FINGERPRINT_COLUMN in merged_df.columns:
+                merged_df = merged_df.drop(columns=FINGERPRINT_COLUMN)
+            merged_data[file_type] = merged_df
+            
+            if report is not None:
+                for position, (df, dropped) in enumerate(zip(dfs, duplicates)):
+                    report.append({
+                        'type': file_type,
+                        'source': df.attrs.get('source', f"{file_type} {position + 1}"),
+                        'rows': len(df),
+                        'duplicates': dropped,
+                    })
         
         return merged_data
 
@@ -978,7 +1070,7 @@ Return ONLY valid JSON."""
             'date': 'Date',
             'course_name': 'Course',
             'trainer_name': 'Trainer',
-            'overall_rating': 'Please give the course a rating out of 5',
+            'overall_rating': RATING_COLUMN,
             'comments': 'Comments'
         }
         
@@ -988,171 +1080,123 @@ Return ONLY valid JSON."""
 # DATA PROCESSOR
 # ============================================================================
 
-class QTSDataProcessor:
-    def __init__(self):
-        self.delegate_data = None
-        self.partner_data = None
-        self.master_data = None
-        
-    def parse_date(self, date_value):
-        """Parse dates with multiple format support"""
-        if pd.isna(date_value):
-            return None
-        
-        date_str = str(date_value).strip()
-        
-        for fmt in DATE_FORMATS:
-            try:
-                return pd.to_datetime(date_str, format=fmt)
-            except:
-                continue
-        
-        try:
-            return pd.to_datetime(date_str)
-        except:
-            return None
-    
-    def get_quarter(self, date):
-        """Assign quarter based on date"""
-        if pd.isna(date):
-            return None
-        try:
-            quarter = f"Q{((date.month - 1) // 3) + 1} {date.year}"
-            return quarter
-        except:
-            return None
-    
-    def process_files(self, uploaded_files: List) -> Tuple[bool, str]:
-        """Process multiple uploaded files with AI segregation"""
-        if not uploaded_files:
-            return False, "No files uploaded"
-        
-        try:
-            categorized_files = {
-                'delegate': [],
-                'partner': [],
-                'master': []
-            }
-            
-            segregator = AIDataSegregator()
-            
-            for uploaded_file in uploaded_files:
-                try:
-                    excel_file = pd.ExcelFile(uploaded_file)
-                    
-                    for sheet_name in excel_file.sheet_names:
-                        df = pd.read_excel(uploaded_file, sheet_name=sheet_name)
-                        
-                        if df.empty:
-                            continue
-                        
-                        file_type = segregator.identify_file_type(df, uploaded_file.name)
-                        categorized_files[file_type].append(df)
-                        
-                except Exception as e:
-                    st.warning(f"Could not process {uploaded_file.name}: {str(e)}")
-                    continue
-            
-            merged_data = segregator.merge_similar_files(categorized_files)
-            
-            if 'delegate' in merged_data:
-                self.delegate_data = self._process_delegate_data(merged_data['delegate'])
-            
-            if 'partner' in merged_data:
-                self.partner_data = merged_data['partner']
-            
-            if 'master' in merged_data:
-                self.master_data = merged_data['master']
-            elif self.delegate_data is not None:
-                self.master_data = self.delegate_data
-            
-            if self.delegate_data is None or len(self.delegate_data) == 0:
-                return False, "No valid delegate feedback data found"
-            
-            return True, f"Successfully processed {len(uploaded_files)} file(s)"
-            
-        except Exception as e:
-            return False, f"Error processing files: {str(e)}"
-    
-    def _process_delegate_data(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Process delegate data with date parsing and quarter assignment"""
-        df = df.copy()
-        
-        date_col = None
-        for col in df.columns:
-            if any(word in str(col).lower() for word in ['date', 'completion', 'submitted', 'time']):
-                date_col = col
-                break
-        
-        if date_col:
-            df['Parsed_Date'] = df[date_col].apply(self.parse_date)
-            df['Quarter'] = df['Parsed_Date'].apply(self.get_quarter)
-        
-        return df
+class QTSDataProcessor(FeedbackProcessor):
+    """Feedback processor set up with this dashboard's segregator, columns and date settings"""
+    segregator = AIDataSegregator
+    rating_column = RATING_COLUMN
+    metric_keywords = METRIC_KEYWORDS
+    date_formats = DATE_FORMATS
+    fiscal_year_start_month = FISCAL_YEAR_START_MONTH
+    parallel_min_mb = PARALLEL_INGEST_MIN_MB
+    streaming_min_mb = STREAMING_MIN_MB
+    stream_chunk_rows = STREAM_CHUNK_ROWS
+    
+    def __init__(self, max_workers: int = INGEST_WORKERS, cache: Optional[IngestCache] = None,
+                 schema_mapping: Optional[Dict] = None, store: Optional[FeedbackStore] = None):
+        super().__init__(max_workers, cache, schema_mapping, store)
+    
+    def warn(self, message: str) -> None:
+        st.warning(message)
 
 # ============================================================================
 # ANALYTICS ENGINE
 # ============================================================================
 
+@st.cache_data(max_entries=ANALYTICS_CACHE_ENTRIES, show_spinner=False)
+def _cached_analytics(dataset_key: str, quarter_key: Optional[Tuple[str, str]], method: str, args: Tuple,
+                      _analytics, _compute):
+    """One QTSAnalytics result per dataset, quarter filter, method and arguments"""
+    return _compute(_analytics, *args)
+
+def memoized(method):
+    """Serve a QTSAnalytics method from the analytics cache, so reruns and other sessions on the same data reuse it"""
+    @functools.wraps(method)
+    def cached(self, *args):
+        return _cached_analytics(self.cache_key[0], self.cache_key[1], method.__name__, args, self, method)
+    return cached
+
 class QTSAnalytics:
-    def __init__(self, processor: QTSDataProcessor):
+    def __init__(self, processor: QTSDataProcessor, data: Optional[pd.DataFrame] = None,
+                 quarter_range: Optional[Tuple[pd.Period, pd.Period]] = None, scan: Optional[Dict] = None):
         self.processor = processor
-        self.df = processor.delegate_data
-    
+        self.df = data if data is not None else processor.delegate_data
+        self.schema = processor.schema
+        self.scan = scan
+        quarter_key = (str(quarter_range[0]), str(quarter_range[1])) if quarter_range is not None else None
+        self.cache_key = (processor.dataset_key(), quarter_key)
+        # Charts and KPI cards are rollups of the cube; self.df is only read for comments
+        self.cube = filter_quarters(processor.aggregate_cube(), quarter_range)
+        self._trainer_layout = None
+    
+    def trainer_rows(self, trainer_name) -> pd.DataFrame:
+        """Zero-copy slice of one trainer's rows, from a layout sorted by trainer once per view"""
+        trainer_col = self.schema['trainer']
+        if trainer_col is None:
+            return self.df.iloc[:0]
+        if self._trainer_layout is None:
+            self._trainer_layout = group_slices(self.df, trainer_col)
+        rows, slices = self._trainer_layout
+        return rows.iloc[slices.get(trainer_name, slice(0, 0))]
+    
+    @memoized
+    def trainer_summary(self, min_responses: int = 3) -> List[Dict]:
+        """Trainers with at least ``min_responses`` responses, best rated first, with their cube totals"""
+        trainers = []
+        for trainer_name, totals in rollup(self.cube, ['trainer']).iterrows():
+            if totals['responses'] >= min_responses:
+                trainers.append({
+                    'name': trainer_name,
+                    'count': int(totals['responses']),
+                    'rating': float(cube_mean(totals)) if self.schema['rating'] else 0,
+                    'totals': totals
+                })
+        trainers.sort(key=lambda x: x['rating'], reverse=True)
+        return trainers
+    
+    @memoized
     def calculate_kpis(self) -> Dict:
         """Calculate comprehensive KPIs"""
         kpis = {}
+        # Merging the per-quarter accumulators costs the same however many rows they cover
+        summary = merge_kpis(self.processor.kpi_accumulators(), self.cache_key[1]).kpis()
         
-        rating_col = 'Please give the course a rating out of 5'
-        if rating_col in self.df.columns:
-            kpis['overall_rating'] = pd.to_numeric(self.df[rating_col], errors='coerce').mean()
-            kpis['total_responses'] = len(self.df)
+        rating_col = self.schema['rating']
+        if rating_col:
+            kpis['overall_rating'] = float(summary['overall_rating'])
+            kpis['total_responses'] = int(summary['total_responses'])
         
-        if rating_col in self.df.columns:
-            ratings = pd.to_numeric(self.df[rating_col], errors='coerce').dropna()
-            promoters = len(ratings[ratings >= 4.5])
-            detractors = len(ratings[ratings <= 3.5])
-            kpis['nps'] = ((promoters - detractors) / len(ratings) * 100) if len(ratings) > 0 else 0
+        if rating_col:
+            kpis['nps'] = float(summary['nps'])
         
-        trainer_col = None
-        for col in self.df.columns:
-            if any(word in col.lower() for word in ['tutor', 'trainer', 'presenter']):
-                trainer_col = col
-                break
+        trainer_col = self.schema['trainer']
         
         if trainer_col:
-            kpis['trainer_count'] = self.df[trainer_col].nunique()
+            kpis['trainer_count'] = summary['trainer_count']
         
-        course_col = None
-        for col in self.df.columns:
-            if 'course' in col.lower():
-                course_col = col
-                break
+        course_col = self.schema['course']
         
         if course_col:
-            kpis['course_count'] = self.df[course_col].nunique()
+            kpis['course_count'] = summary['course_count']
         
         return kpis
     
+    @memoized
     def create_trend_chart(self):
         """Create trend chart"""
         if 'Quarter' not in self.df.columns:
             return None
         
-        rating_col = 'Please give the course a rating out of 5'
-        if rating_col not in self.df.columns:
+        rating_col = self.schema['rating']
+        if not rating_col:
             return None
         
-        df_trend = self.df.groupby('Quarter')[rating_col].apply(
-            lambda x: pd.to_numeric(x, errors='coerce').mean()
-        ).reset_index()
+        df_trend = cube_mean(rollup(self.cube, ['quarter'])).reset_index()
         df_trend.columns = ['Quarter', 'Average_Rating']
-        df_trend = df_trend.sort_values('Quarter')
         
         fig = go.Figure()
         
         fig.add_trace(go.Scatter(
-            x=df_trend['Quarter'],
+            x=quarter_labels(df_trend['Quarter'], FISCAL_YEAR_START_MONTH),
             y=df_trend['Average_Rating'],
             fill='tozeroy',
             fillcolor='rgba(46, 80, 144, 0.1)',
@@ -1180,24 +1224,19 @@ class QTSAnalytics:
         
         return fig
     
+    @memoized
     def create_trainer_comparison(self):
         """Create trainer comparison chart"""
-        trainer_col = None
-        for col in self.df.columns:
-            if any(word in col.lower() for word in ['tutor', 'trainer', 'presenter']):
-                trainer_col = col
-                break
+        trainer_col = self.schema['trainer']
         
         if not trainer_col:
             return None
         
-        rating_col = 'Please give the course a rating out of 5'
-        if rating_col not in self.df.columns:
+        rating_col = self.schema['rating']
+        if not rating_col:
             return None
         
-        df_trainers = self.df.groupby(trainer_col)[rating_col].apply(
-            lambda x: pd.to_numeric(x, errors='coerce').mean()
-        ).reset_index()
+        df_trainers = cube_mean(rollup(self.cube, ['trainer'])).reset_index()
         df_trainers.columns = ['Trainer', 'Average_Rating']
         df_trainers = df_trainers.sort_values('Average_Rating', ascending=True)
         
@@ -1234,26 +1273,19 @@ class QTSAnalytics:
         
         return fig
     
+    @memoized
     def create_satisfaction_donut(self):
         """Create satisfaction distribution donut chart"""
-        rating_col = 'Please give the course a rating out of 5'
-        if rating_col not in self.df.columns:
+        rating_col = self.schema['rating']
+        if not rating_col:
             return None
         
-        ratings = pd.to_numeric(self.df[rating_col], errors='coerce').dropna()
+        totals = rollup(self.cube)
+        rated = int(totals['rated'])
         
-        categories = []
-        for rating in ratings:
-            if rating >= 4.5:
-                categories.append('Outstanding (4.5-5)')
-            elif rating >= 4.0:
-                categories.append('Excellent (4-4.5)')
-            elif rating >= 3.5:
-                categories.append('Good (3.5-4)')
-            else:
-                categories.append('Needs Improvement (<3.5)')
+        bands = pd.Series({label: totals[key] for key, label, _ in SATISFACTION_BANDS}).astype(int)
         
-        df_dist = pd.Series(categories).value_counts()
+        df_dist = bands[bands > 0].sort_values(ascending=False, kind='stable')
         
         colors = ['#10b981', '#2E5090', '#f59e0b', '#ef4444']
         
@@ -1273,7 +1305,7 @@ class QTSAnalytics:
                 font=dict(family='Playfair Display, Georgia, serif', size=18, color='#1a1a1a')
             ),
             annotations=[dict(
-                text=f'{len(ratings)}<br>Total',
+                text=f'{rated}<br>Total',
                 x=0.5, y=0.5,
                 font=dict(size=18, family='Playfair Display, Georgia, serif', color='#2E5090'),
                 showarrow=False
@@ -1292,18 +1324,15 @@ class QTSAnalytics:
 # ============================================================================
 
 class AIInsightsEngine:
-    def __init__(self):
-        api_key = None
-        if hasattr(st, 'secrets') and 'OPENAI_API_KEY' in st.secrets:
-            api_key = st.secrets['OPENAI_API_KEY']
-        else:
-            api_key = os.getenv('OPENAI_API_KEY')
+    def __init__(self, cache: Optional[ResponseCache] = None, stream: bool = AI_STREAMING,
+                 health: Optional[HealthCheck] = None):
+        api_key = get_openai_api_key()
         
         self.client = None
         if api_key and OpenAI:
             try:
+                # Reachability is checked by the shared health check, not on every rerun
                 self.client = OpenAI(api_key=api_key, timeout=30.0, max_retries=2)
-                self.client.models.list()
             except TypeError as e:
                 error_msg = str(e)
                 if 'proxies' in error_msg or 'http_client' in error_msg:
@@ -1322,10 +1351,17 @@ class AIInsightsEngine:
             st.warning("OpenAI library not found. Install: pip install openai")
         
         self.model = "gpt-3.5-turbo"
-        self.available = self.client is not None
-    
-    def generate_overall_insights(self, kpis: Dict, df: pd.DataFrame) -> str:
-        """Generate AI-powered overall insights"""
+        self.cache = cache
+        self.stream = stream
+        # One record per request: cached, seconds to first token and to the whole answer
+        self.timings = []
+        self.health = health
+        self.available = self.client is not None and (health is None or health.available())
+        if self.client is not None and health is not None and not health.pending and not self.available:
+            st.error(f"OpenAI connection error: {str(health.error)[:100]}")
+    
+    def generate_overall_insights(self, kpis: Dict, df: pd.DataFrame, on_token=None) -> str:
+        """Generate AI-powered overall insights, passing the text so far to ``on_token`` while streaming"""
         if not self.available:
             return self._generate_fallback_overall_insights(kpis)
         
@@ -1345,10 +1381,10 @@ Provide 3 bullet points:
 
 Keep it concise, professional, and actionable. Use bullet points."""
         
-        return self._call_openai(prompt)
+        return self._call_openai(prompt, on_token)
     
-    def generate_trainer_insights(self, trainer_name: str, metrics: Dict, comments: List[str]) -> str:
-        """Generate personalized trainer insights"""
+    def generate_trainer_insights(self, trainer_name: str, metrics: Dict, comments: List[str], on_token=None) -> str:
+        """Generate personalized trainer insights, passing the text so far to ``on_token`` while streaming"""
         if not self.available:
             return self._generate_fallback_trainer_insights(trainer_name, metrics)
         
@@ -1374,23 +1410,40 @@ RULES:
 
 Write a natural summary:"""
         
-        return self._call_openai(prompt)
-    
-    def _call_openai(self, prompt: str) -> str:
-        """Call OpenAI API"""
+        return self._call_openai(prompt, on_token)
+    
+    def _call_openai(self, prompt: str, on_token=None) -> str:
+        """Call OpenAI API, reusing the cached response to an identical request"""
+        messages = [
+            {"role": "system", "content": "You are a data analyst creating performance summaries. Be specific and cite actual data."},
+            {"role": "user", "content": prompt}
+        ]
+        params = {'max_tokens': 300, 'temperature': 0.8}
+        key = ResponseCache.key('openai', self.model, messages, params)
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            self.timings.append({'cached': True, 'first_token': None, 'total': 0.0})
+            return cached
+        
+        started = time.time()
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a data analyst creating performance summaries. Be specific and cite actual data."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=300,
-                temperature=0.8
-            )
-            return response.choices[0].message.content.strip()
+            if self.stream and on_token is not None:
+                stream = self.client.chat.completions.create(model=self.model, messages=messages, stream=True, **params)
+                result, first_token = read_openai_stream(stream, on_token, started)
+                result = result.strip()
+            else:
+                response = self.client.chat.completions.create(model=self.model, messages=messages, **params)
+                result = response.choices[0].message.content.strip()
+                first_token = time.time() - started
         except Exception as e:
+            if self.health is not None:
+                self.health.invalidate(str(e))
             return f"AI insights unavailable: {str(e)}"
+        self.timings.append({'cached': False, 'first_token': first_token, 'total': time.time() - started})
+        
+        if self.cache is not None:
+            self.cache.put(key, 'openai', self.model, result)
+        return result
     
     def _generate_fallback_overall_insights(self, kpis: Dict) -> str:
         """Generate insights without AI"""
@@ -1441,16 +1494,127 @@ def get_trainer_color(trainer_name: str) -> str:
 
 def get_performance_level(rating: float) -> Tuple[str, str]:
     """Get performance level and color for rating"""
-    for threshold, (level, color) in sorted(PERFORMANCE_LEVELS.items(), reverse=True):
-        if rating >= threshold:
-            return level, color
-    return 'Needs Improvement', '#ef4444'
+    return PERFORMANCE_LEVELS[satisfaction_band(rating)]
+
+def render_overall_insight(slot, insights: str) -> None:
+    """Draw the dashboard-wide AI insight card into a placeholder"""
+    slot.markdown(f"""
+        <div class="ai-insight">
+            <div class="ai-insight-header">
+                <div class="ai-insight-icon">◈</div>
+                <span class="ai-insight-title">AI-Powered Insights</span>
+            </div>
+            <div class="ai-insight-content">
+                {insights}
+            </div>
+        </div>
+    """, unsafe_allow_html=True)
+
+def latency_caption(timings: List[Dict]) -> Optional[str]:
+    """One line on how quickly the AI answered, or None when nothing was requested"""
+    summary = timing_summary(timings)
+    if not summary['requests']:
+        return None
+    if summary['total'] is None:
+        return f"{summary['requests']} AI response(s) served from cache"
+    first_token = f"first token after {summary['first_token']:.2f}s, " if summary['first_token'] is not None else ""
+    return (f"{summary['requests']} AI response(s), {summary['cached']} from cache; "
+            f"median {first_token}complete after {summary['total']:.2f}s")
+
+def render_trainer_insight(slot, color: str, insights: str) -> None:
+    """Draw a trainer's performance summary card into a placeholder"""
+    slot.markdown(f"""
+        <div class="ai-insight" style="background: linear-gradient(135deg, {color} 0%, {color}dd 100%);">
+            <div class="ai-insight-header">
+                <div class="ai-insight-icon">✦</div>
+                <span class="ai-insight-title">Performance Summary</span>
+            </div>
+            <div class="ai-insight-content">
+                {insights}
+            </div>
+        </div>
+    """, unsafe_allow_html=True)
+
+def select_quarter_range(processor: QTSDataProcessor) -> Optional[Tuple[pd.Period, pd.Period]]:
+    """Sidebar slider over the loaded quarters; None while every quarter is selected"""
+    if 'Quarter' not in processor.delegate_data.columns:
+        return None
+    quarters = processor.aggregate_cube()['quarter'].dropna().drop_duplicates().sort_values()
+    if len(quarters) < 2:
+        return None
+    labels = dict(zip(quarters, quarter_labels(quarters, FISCAL_YEAR_START_MONTH)))
+    start, end = st.sidebar.select_slider(
+        "Quarters",
+        options=list(quarters),
+        value=(quarters.iloc[0], quarters.iloc[-1]),
+        format_func=labels.get
+    )
+    if start == quarters.iloc[0] and end == quarters.iloc[-1]:
+        return None
+    return start, end
+
+def get_analytics(processor: QTSDataProcessor, quarter_range: Optional[Tuple[pd.Period, pd.Period]]) -> QTSAnalytics:
+    """This session's analytics for the loaded data and quarter filter, rebuilt only when either changes"""
+    quarter_key = (str(quarter_range[0]), str(quarter_range[1])) if quarter_range is not None else None
+    analytics = st.session_state.get('analytics')
+    if analytics is None or analytics.processor is not processor or analytics.cache_key != (processor.dataset_key(), quarter_key):
+        view, scan = processor.load_view(quarter_range)
+        analytics = QTSAnalytics(processor, view, quarter_range, scan)
+        st.session_state.analytics = analytics
+    return analytics
+
+def get_schema_mapping() -> Dict:
+    """User-supplied column mapping from QTS_SCHEMA_MAP, if one is configured"""
+    try:
+        return load_schema_mapping(SCHEMA_MAP_PATH)
+    except (OSError, ValueError) as e:
+        st.warning(f"Ignoring schema mapping {SCHEMA_MAP_PATH}: {e}")
+        return {}
+
+@st.cache_resource
+def get_ingest_cache() -> IngestCache:
+    """Process-wide ingest cache shared by every session"""
+    return IngestCache(INGEST_CACHE_DIR, INGEST_CACHE_MB * 1024 * 1024)
+
+@st.cache_resource
+def get_feedback_store() -> FeedbackStore:
+    """Process-wide feedback store shared by every session"""
+    return FeedbackStore(FEEDBACK_STORE_DIR)
+
+def get_openai_api_key() -> Optional[str]:
+    """OpenAI API key from Streamlit secrets or the environment"""
+    try:
+        if 'OPENAI_API_KEY' in st.secrets:
+            return st.secrets['OPENAI_API_KEY']
+    except Exception:
+        # No secrets.toml (StreamlitSecretNotFoundError) or an unreadable one
+        pass
+    return os.getenv('OPENAI_API_KEY')
+
+@st.cache_resource
+def get_openai_health(api_key: Optional[str]) -> Optional[HealthCheck]:
+    """Process-wide OpenAI availability for one API key, re-probed in the background once it is PROVIDER_HEALTH_TTL seconds old"""
+    if not api_key or not OpenAI:
+        return None
+    
+    def probe() -> bool:
+        return OpenAI(api_key=api_key, timeout=5.0, max_retries=0).models.list() is not None
+    
+    return HealthCheck(probe, PROVIDER_HEALTH_TTL)
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """Process-wide LLM response cache shared by every session"""
+    return ResponseCache(LLM_CACHE_PATH, LLM_CACHE_TTL_HOURS * 3600, LLM_CACHE_MB * 1024 * 1024)
 
 # ============================================================================
 # MAIN APPLICATION
 # ============================================================================
 
 def main():
+    # Start probing OpenAI now so its status is known by the time insights are drawn
+    get_openai_health(get_openai_api_key())
+    
     # Hero Header
     st.markdown("""
         <div class="hero-header">
@@ -1508,6 +1672,19 @@ def main():
             </div>
         """, unsafe_allow_html=True)
     
+    # Data saved by an earlier session is only loaded on request, never into a fresh session by itself
+    store = get_feedback_store()
+    if not st.session_state.processed and store.enabled:
+        saved_at = store.info()['saved_at']
+        if saved_at is not None and st.button(f"↺ Load Data Stored {saved_at}", use_container_width=True):
+            processor = QTSDataProcessor(cache=get_ingest_cache(), schema_mapping=get_schema_mapping(), store=store)
+            if processor.restore():
+                st.session_state.processor = processor
+                st.session_state.processed = True
+                st.success(f"✓ Loaded {len(processor.delegate_data):,} stored delegate records")
+            else:
+                st.warning("The stored data could not be loaded.")
+    
     # Process Button
     if uploaded_files and st.button("◆ Process Data with AI", type="primary", use_container_width=True):
         with st.spinner(""):
@@ -1523,7 +1700,8 @@ def main():
                 </div>
             """, unsafe_allow_html=True)
             
-            processor = QTSDataProcessor()
+            processor = QTSDataProcessor(cache=get_ingest_cache(), schema_mapping=get_schema_mapping(),
+                                         store=get_feedback_store())
             success, message = processor.process_files(uploaded_files)
             
             if success:
@@ -1559,15 +1737,32 @@ def main():
             else:
                 st.error(f"✗ {message}")
     
+    if uploaded_files and st.session_state.processed and 'processor' in st.session_state:
+        if st.button("◆ Append New Files", use_container_width=True):
+            with st.spinner("Appending new files..."):
+                success, message = st.session_state.processor.append_files(uploaded_files)
+            if success:
+                st.success(f"✓ {message}")
+            else:
+                st.warning(message)
+    
     # Display Analytics
     if st.session_state.processed and 'processor' in st.session_state:
         processor = st.session_state.processor
-        analytics = QTSAnalytics(processor)
-        ai_engine = AIInsightsEngine()
+        quarter_range = select_quarter_range(processor)
+        analytics = get_analytics(processor, quarter_range)
+        scan = analytics.scan
+        st.sidebar.caption(
+            f"Trainer comments and the overall insight read {scan['rows']:,} of {scan['total_rows']:,} rows "
+            f"({scan['quarters']} of {scan['total_quarters']} quarter(s)); KPI cards and charts use the aggregate cube"
+        )
+        ai_engine = AIInsightsEngine(cache=get_response_cache(), health=get_openai_health(get_openai_api_key()))
         
         if ai_engine.available:
             st.success("✓ OpenAI API Connected - AI insights enabled")
-        else:
+        elif ai_engine.health is not None and ai_engine.health.pending:
+            st.info("Checking the OpenAI connection. Fallback insights are shown until it answers.")
+        elif ai_engine.client is None:
             st.info("OpenAI API not configured. Using fallback insights. Add OPENAI_API_KEY to secrets for AI features.")
         
         kpis = analytics.calculate_kpis()
@@ -1621,19 +1816,12 @@ def main():
         
         # AI Insights
         if ai_engine.available:
-            with st.spinner("AI is analyzing your data..."):
-                overall_insights = ai_engine.generate_overall_insights(kpis, processor.delegate_data)
-                st.markdown(f"""
-                    <div class="ai-insight">
-                        <div class="ai-insight-header">
-                            <div class="ai-insight-icon">◈</div>
-                            <span class="ai-insight-title">AI-Powered Insights</span>
-                        </div>
-                        <div class="ai-insight-content">
-                            {overall_insights}
-                        </div>
-                    </div>
-                """, unsafe_allow_html=True)
+            insight_slot = st.empty()
+            render_overall_insight(insight_slot, "AI is analyzing your data...")
+            overall_insights = ai_engine.generate_overall_insights(
+                kpis, analytics.df, on_token=lambda text: render_overall_insight(insight_slot, text + " ▌")
+            )
+            render_overall_insight(insight_slot, overall_insights)
         
         # Tabs
         tab1, tab2, tab3, tab4, tab5 = st.tabs(["◆ Visualizations", "● Trainers", "◆ Partners", "■ Data", "◆ Scanned Forms"])
@@ -1668,29 +1856,10 @@ def main():
             
             st.markdown('<div class="section-header">Trainer Profiles</div>', unsafe_allow_html=True)
             
-            trainer_col = None
-            for col in processor.delegate_data.columns:
-                if any(word in col.lower() for word in ['tutor', 'trainer', 'presenter']):
-                    trainer_col = col
-                    break
+            trainer_col = processor.schema['trainer']
             
             if trainer_col:
-                trainers_data = []
-                
-                for trainer_name in processor.delegate_data[trainer_col].unique():
-                    if pd.notna(trainer_name):
-                        df_trainer = processor.delegate_data[processor.delegate_data[trainer_col] == trainer_name]
-                        if len(df_trainer) >= 3:
-                            rating_col = 'Please give the course a rating out of 5'
-                            avg_rating = pd.to_numeric(df_trainer[rating_col], errors='coerce').mean() if rating_col in df_trainer.columns else 0
-                            trainers_data.append({
-                                'name': trainer_name,
-                                'count': len(df_trainer),
-                                'rating': avg_rating,
-                                'data': df_trainer
-                            })
-                
-                trainers_data.sort(key=lambda x: x['rating'], reverse=True)
+                trainers_data = analytics.trainer_summary()
                 
                 if trainers_data:
                     trainer_options = ["★ View All Trainers"] + [
@@ -1710,22 +1879,23 @@ def main():
                         selected_name = selected_option.split(" - ")[0]
                         trainers_to_show = [t for t in trainers_data if t['name'] == selected_name]
                     
+                    # Cards awaiting an AI summary: name -> (placeholder, color, metrics, comments)
+                    pending = {}
+                    
                     for idx, trainer_info in enumerate(trainers_to_show):
                         trainer_name = trainer_info['name']
-                        df_trainer = trainer_info['data']
+                        # Rows are only needed for this trainer's comments
+                        df_trainer = analytics.trainer_rows(trainer_name)
                         
                         color = get_trainer_color(trainer_name)
                         
                         metrics = {}
-                        for metric_key in ['knowledge', 'adaptability', 'feedback', 'guidance']:
-                            cols = [col for col in df_trainer.columns if metric_key.lower() in col.lower()]
-                            if cols:
-                                metrics[metric_key] = pd.to_numeric(df_trainer[cols[0]], errors='coerce').mean()
+                        for metric_key, metric_col in processor.schema['metrics'].items():
+                            metrics[metric_key] = float(cube_mean(trainer_info['totals'], metric_col))
                         
-                        rating_col = 'Please give the course a rating out of 5'
                         avg_rating = trainer_info['rating']
                         metrics['overall'] = avg_rating
-                        metrics['count'] = len(df_trainer)
+                        metrics['count'] = trainer_info['count']
                         
                         performance, perf_color = get_performance_level(avg_rating)
                         
@@ -1743,7 +1913,7 @@ def main():
                                         <div class="trainer-metric-label">Avg Rating</div>
                                     </div>
                                     <div class="trainer-metric">
-                                        <div class="trainer-metric-value">{len(df_trainer)}</div>
+                                        <div class="trainer-metric-value">{trainer_info['count']}</div>
                                         <div class="trainer-metric-label">Sessions</div>
                                     </div>
                                     <div class="trainer-metric">
@@ -1759,33 +1929,18 @@ def main():
                         """, unsafe_allow_html=True)
                         
                         # AI Insights
-                        feedback_col = None
-                        for col in df_trainer.columns:
-                            if any(word in col.lower() for word in ['comment', 'feedback']):
-                                feedback_col = col
-                                break
+                        feedback_col = processor.schema['comment']
                         
                         comments = df_trainer[feedback_col].dropna().tolist() if feedback_col else []
                         
                         text_color = get_contrast_text_color(color)
                         
+                        insight_slot = st.empty()
                         if ai_engine.available:
-                            with st.spinner(f"AI analyzing {trainer_name}'s performance..."):
-                                trainer_insights = ai_engine.generate_trainer_insights(trainer_name, metrics, comments)
+                            render_trainer_insight(insight_slot, color, f"AI analyzing {trainer_name}'s performance...")
+                            pending[trainer_name] = (insight_slot, color, metrics, comments)
                         else:
-                            trainer_insights = ai_engine._generate_fallback_trainer_insights(trainer_name, metrics)
-                        
-                        st.markdown(f"""
-                            <div class="ai-insight" style="background: linear-gradient(135deg, {color} 0%, {color}dd 100%);">
-                                <div class="ai-insight-header">
-                                    <div class="ai-insight-icon">✦</div>
-                                    <span class="ai-insight-title">Performance Summary</span>
-                                </div>
-                                <div class="ai-insight-content">
-                                    {trainer_insights}
-                                </div>
-                            </div>
-                        """, unsafe_allow_html=True)
+                            render_trainer_insight(insight_slot, color, ai_engine._generate_fallback_trainer_insights(trainer_name, metrics))
                         
                         # Feedback quotes
                         if feedback_col and comments:
@@ -1809,6 +1964,19 @@ def main():
                         
                         if idx < len(trainers_to_show) - 1:
                             st.markdown('<hr style="margin: 2rem 0; border: none; border-top: 1px solid #E5E7EB;">', unsafe_allow_html=True)
+                    
+                    # Request every summary at once; tokens stream into each card as they arrive
+                    tasks = {
+                        name: functools.partial(ai_engine.generate_trainer_insights, name, metrics, comments)
+                        for name, (_, _, metrics, comments) in pending.items()
+                    }
+                    for trainer_name, trainer_insights, done, error in stream_concurrently(tasks, AI_CONCURRENCY):
+                        insight_slot, color, metrics, _ = pending[trainer_name]
+                        if error is not None:
+                            trainer_insights = ai_engine._generate_fallback_trainer_insights(trainer_name, metrics)
+                        render_trainer_insight(insight_slot, color, trainer_insights if done else trainer_insights + " ▌")
+                    if pending and latency_caption(ai_engine.timings):
+                        st.caption(latency_caption(ai_engine.timings))
         
         with tab3:
             st.markdown('<div class="section-header">Partner Feedback</div>', unsafe_allow_html=True)
@@ -1828,19 +1996,85 @@ def main():
         with tab4:
             st.markdown('<div class="section-header">Raw Data</div>', unsafe_allow_html=True)
             
+            # Row fingerprints are only kept for deduplication, never shown or exported
+            raw_data = without_fingerprints(processor.delegate_data)
+            
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Total Records", f"{len(processor.delegate_data):,}")
+                st.metric("Total Records", f"{len(raw_data):,}")
             with col2:
-                st.metric("Columns", len(processor.delegate_data.columns))
+                st.metric("Columns", len(raw_data.columns))
             with col3:
-                st.metric("Missing Values", f"{processor.delegate_data.isnull().sum().sum():,}")
+                st.metric("Missing Values", f"{raw_data.isnull().sum().sum():,}")
+            
+            if processor.ingest_timings:
+                with st.expander("Ingest Timings", expanded=False):
+                    timings = pd.DataFrame(processor.ingest_timings)
+                    st.caption(f"Parsed {timings['sheets'].sum()} sheet(s) from {len(timings)} file(s) in {processor.ingest_seconds:.2f}s "
+                               f"({timings['seconds'].sum():.2f}s of parse time across workers)")
+                    st.dataframe(timings, use_container_width=True)
+                    
+                    if processor.cache is not None:
+                        cache_stats = processor.cache.stats()
+                        if cache_stats['enabled']:
+                            st.caption(f"Ingest cache: {cache_stats['hits']} hit(s), {cache_stats['misses']} miss(es), "
+                                       f"{cache_stats['size_mb']:.1f} of {cache_stats['max_mb']:.0f} MB used")
+                        else:
+                            st.caption("Ingest cache disabled. Install pyarrow to cache parsed workbooks.")
+            
+            if processor.merge_report:
+                with st.expander("Merge Log", expanded=False):
+                    merge_report = pd.DataFrame(processor.merge_report)
+                    st.caption(f"Removed {merge_report['duplicates'].sum():,} duplicate row(s) while merging "
+                               f"{len(merge_report)} sheet(s), matched on row fingerprints")
+                    st.dataframe(merge_report, use_container_width=True)
+                    if processor.merge_log:
+                        merge_log = pd.DataFrame(processor.merge_log)
+                        renamed = merge_log['merged_from'].str.contains(' | ', regex=False).sum()
+                        st.caption(f"Aligned {len(merge_log)} column(s) across sheets of the same type; "
+                                   f"{renamed} had headers differing only in spacing or case")
+                        st.dataframe(merge_log, use_container_width=True)
+            
+            if processor.memory_report is not None:
+                with st.expander("Memory Footprint", expanded=False):
+                    report = processor.memory_report
+                    st.caption(f"Delegate data uses {report['after_kb'].sum() / 1024:.1f} MB after numeric and categorical "
+                               f"encoding ({report['before_kb'].sum() / 1024:.1f} MB as loaded)")
+                    st.dataframe(report, use_container_width=True)
+            
+            store = get_feedback_store()
+            with st.expander("Feedback Store", expanded=False):
+                store_info = store.info()
+                if not store_info['enabled']:
+                    st.caption("Feedback store disabled. Install pyarrow and set QTS_STORE_DIR to keep data between sessions.")
+                elif store_info['saved_at'] is None:
+                    st.caption("Nothing stored yet.")
+                else:
+                    st.caption(f"Saved {store_info['saved_at']} to {store.directory} "
+                               f"({store_info['size_mb']:.1f} MB); new sessions can load it from the upload page without re-uploading")
+                    st.dataframe(pd.DataFrame(store_info['tables']).T, use_container_width=True)
+                    if st.button("Clear Stored Data", key="clear_feedback_store"):
+                        store.clear()
+                        st.success("Stored data cleared. The current session keeps its data until it ends.")
+            
+            with st.expander("AI Response Cache", expanded=False):
+                response_cache = get_response_cache()
+                cache_stats = response_cache.stats()
+                if not cache_stats['enabled']:
+                    st.caption("AI response cache disabled. Set QTS_LLM_CACHE to a file path to reuse insights across reruns.")
+                else:
+                    st.caption(f"{cache_stats['entries']} stored insight(s), {cache_stats['size_mb']:.2f} of {cache_stats['max_mb']:.0f} MB; "
+                               f"{cache_stats['hits']} hit(s), {cache_stats['misses']} miss(es) since start. "
+                               f"Insights expire after {LLM_CACHE_TTL_HOURS:g} hours.")
+                    if st.button("Clear AI Responses", key="clear_response_cache"):
+                        response_cache.clear()
+                        st.success("Stored AI responses cleared.")
             
-            st.dataframe(processor.delegate_data, use_container_width=True, height=400)
+            st.dataframe(raw_data, use_container_width=True, height=400)
             
             col1, col2 = st.columns(2)
             with col1:
-                csv = processor.delegate_data.to_csv(index=False)
+                csv = raw_data.to_csv(index=False)
                 st.download_button(
                     "↓ Download CSV",
                     csv,
@@ -1852,7 +2086,7 @@ def main():
             with col2:
                 output = io.BytesIO()
                 with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    processor.delegate_data.to_excel(writer, index=False, sheet_name='Data')
+                    raw_data.to_excel(writer, index=False, sheet_name='Data')
                 
                 st.download_button(
                     "↓ Download Excel",
@@ -1941,7 +2175,7 @@ def main():
                             
                             with col3:
                                 if st.button("◆ Merge with Dataset", use_container_width=True):
-                                    processor.delegate_data = pd.concat([processor.delegate_data, df_ocr], ignore_index=True)
+                                    processor.append_frames({'delegate': [processor._process_delegate_data(df_ocr)]})
                                     st.success("✓ Merged! Refresh to see updated analytics.")
                                     st.rerun()
                 else:
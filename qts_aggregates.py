@@ -0,0 +1,333 @@
+"""Additive feedback aggregates shared by the QTS Analytics charts and KPI cards."""
+
+import base64
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Dimensions of the aggregation cube
+CUBE_KEYS = ['trainer', 'course', 'quarter']
+
+# Satisfaction bands of the donut, best first: (cube column, label, lowest rating in the band)
+SATISFACTION_BANDS = [
+    ('promoters', 'Outstanding (4.5-5)', 4.5),
+    ('excellent', 'Excellent (4-4.5)', 4.0),
+    ('good', 'Good (3.5-4)', 3.5),
+    ('needs_improvement', 'Needs Improvement (<3.5)', -np.inf),
+]
+
+# NPS thresholds of the KPI cards: promoters are the top band, detractors rate at most the floor of 'Good'
+PROMOTER_MIN = SATISFACTION_BANDS[0][2]
+DETRACTOR_MAX = SATISFACTION_BANDS[2][2]
+
+# Distinct-count sketches: 2**precision registers, exact hash sets until a quarter of that many values
+SKETCH_PRECISION = 12
+SKETCH_SPARSE_LIMIT = (1 << SKETCH_PRECISION) // 4
+
+# ============================================================================
+# RATING BANDS
+# ============================================================================
+
+def rating_bands(ratings, thresholds) -> np.ndarray:
+    """Band of every rating for band floors listed best first, in one vectorized step.
+
+    Returns 0 for the top band up to ``len(thresholds) - 1`` for the lowest
+    (which also takes anything below its floor), and -1 for missing ratings.
+    """
+    floors = np.asarray(thresholds, dtype=np.float64)[::-1]
+    values = np.asarray(ratings, dtype=np.float64)
+    position = np.searchsorted(floors, values, side='right') - 1
+    bands = len(floors) - 1 - np.maximum(position, 0)
+    return np.where(np.isnan(values), -1, bands)
+
+def rating_band(rating: float, thresholds) -> int:
+    """``rating_bands`` for a single rating"""
+    return int(rating_bands([rating], thresholds)[0])
+
+def satisfaction_band(rating: float) -> str:
+    """Cube column of the ``SATISFACTION_BANDS`` band a single rating falls in; a missing rating gets the lowest"""
+    return SATISFACTION_BANDS[rating_band(rating, [floor for _, _, floor in SATISFACTION_BANDS])][0]
+
+# ============================================================================
+# AGGREGATION CUBE
+# ============================================================================
+
+def build_cube(df: pd.DataFrame, trainer_col: Optional[str], course_col: Optional[str],
+               rating_col: Optional[str], metric_columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Sum the additive statistics of every trainer × course × quarter group.
+
+    Each row holds the group keys, the response count, the count, sum and
+    sum of squares of ratings, the detractor count, one count per
+    ``SATISFACTION_BANDS`` band (the top band being the promoters), and a ``<column> sum`` / ``<column> n`` pair for every
+    sub-metric column. Rows with a missing key form their own group.
+    Everything is a sum, so cubes of disjoint rows combine exactly with
+    ``combine_cubes`` and any view is a rollup of cube rows.
+    """
+    def column(name):
+        return df[name] if name and name in df.columns else pd.Series(np.nan, index=df.index)
+
+    keys = pd.DataFrame({
+        'trainer': column(trainer_col),
+        'course': column(course_col),
+        'quarter': column('Quarter'),
+    }, index=df.index)
+
+    rating = column(rating_col).astype(np.float64)
+    bands = rating_bands(rating, [floor for _, _, floor in SATISFACTION_BANDS])
+    stats = {
+        'responses': np.ones(len(df), dtype=np.int64),
+        'rated': rating.notna().astype(np.int64),
+        'rating_sum': rating.fillna(0.0),
+        'rating_sq': (rating * rating).fillna(0.0),
+        'detractors': (rating <= DETRACTOR_MAX).astype(np.int64),
+    }
+    for band, (key, _, _) in enumerate(SATISFACTION_BANDS):
+        stats[key] = (bands == band).astype(np.int64)
+    for col in dict.fromkeys(metric_columns or []):
+        values = column(col).astype(np.float64)
+        stats[f"{col} sum"] = values.fillna(0.0)
+        stats[f"{col} n"] = values.notna().astype(np.int64)
+
+    cube = pd.concat([keys, pd.DataFrame(stats, index=df.index)], axis=1)
+    cube = cube.groupby(CUBE_KEYS, dropna=False, observed=True, sort=False).sum().reset_index()
+    # Categorical keys of different uploads would not concatenate cleanly
+    for key in ('trainer', 'course'):
+        if isinstance(cube[key].dtype, pd.CategoricalDtype):
+            cube[key] = cube[key].astype(object)
+    return cube
+
+def combine_cubes(cubes: List[pd.DataFrame]) -> pd.DataFrame:
+    """Merge cubes of disjoint rows into one, as if built from all the rows together"""
+    cubes = [cube for cube in cubes if cube is not None and len(cube)]
+    if not cubes:
+        return build_cube(pd.DataFrame(), None, None, None)
+    merged = pd.concat(cubes, ignore_index=True)
+    if len(cubes) == 1:
+        return merged
+    # A sub-metric missing from one cube simply contributes nothing to it
+    values = [col for col in merged.columns if col not in CUBE_KEYS]
+    merged[values] = merged[values].fillna(0)
+    return merged.groupby(CUBE_KEYS, dropna=False, sort=False).sum().reset_index()
+
+def filter_quarters(cube: pd.DataFrame, quarter_range: Optional[Tuple] = None) -> pd.DataFrame:
+    """Cube rows within an inclusive quarter range; all rows when there is no range"""
+    if quarter_range is None:
+        return cube
+    quarters = cube['quarter']
+    return cube[(quarters >= quarter_range[0]) & (quarters <= quarter_range[1])]
+
+def rollup(cube: pd.DataFrame, by: Optional[List[str]] = None):
+    """Totals of the cube per group of ``by`` keys (groups with a missing key dropped), or overall as a Series"""
+    values = cube.drop(columns=[key for key in CUBE_KEYS if key not in (by or [])])
+    if not by:
+        return values.sum()
+    return values.groupby(by, sort=True).sum()
+
+def cube_mean(totals, column: str = 'rating'):
+    """Mean from rolled-up totals: ``rating`` or a sub-metric column; NaN where nothing was counted"""
+    sums = totals['rating_sum'] if column == 'rating' else totals[f"{column} sum"]
+    counts = totals['rated'] if column == 'rating' else totals[f"{column} n"]
+    if np.ndim(counts) == 0:
+        return sums / counts if counts else np.nan
+    return sums / counts.where(counts > 0)
+
+# ============================================================================
+# GROUPED ROW LAYOUT
+# ============================================================================
+
+def group_slices(df: pd.DataFrame, column: str) -> Tuple[pd.DataFrame, Dict]:
+    """Reorder rows so each value of ``column`` is contiguous, with one slice per value.
+
+    One stable sort replaces a boolean mask per group: ``rows.iloc[slices[value]]``
+    is a zero-copy view of that group's rows in their original order.
+    Rows with a missing value are kept at the front and have no slice.
+    """
+    codes, uniques = pd.factorize(df[column], sort=False)
+    order = np.argsort(codes, kind='stable')
+    missing = int((codes < 0).sum())
+    bounds = missing + np.concatenate([[0], np.cumsum(np.bincount(codes[codes >= 0], minlength=len(uniques)))])
+    slices = {value: slice(int(bounds[position]), int(bounds[position + 1])) for position, value in enumerate(uniques)}
+    return df.iloc[order], slices
+
+# ============================================================================
+# KPI ACCUMULATORS
+# ============================================================================
+
+def _encode_array(values: np.ndarray) -> str:
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+def _decode_array(text: str, dtype) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(text), dtype=dtype).copy()
+
+class DistinctSketch:
+    """Mergeable estimate of how many distinct values were seen (HyperLogLog).
+
+    Values are hashed to 64 bits. Small sets keep the exact hashes, so
+    counts of a few hundred trainers or courses stay exact; past
+    ``SKETCH_SPARSE_LIMIT`` they collapse into ``2**precision`` one-byte
+    registers, about 1.6% error. Merging takes the union of the hashes or the
+    register-wise maximum, so sketches of disjoint or overlapping chunks
+    combine into the sketch of all their rows.
+    """
+
+    def __init__(self, precision: int = SKETCH_PRECISION):
+        self.precision = precision
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.registers = None
+
+    def _densify(self) -> None:
+        registers = np.zeros(1 << self.precision, dtype=np.uint8)
+        self._add_registers(registers, self.hashes)
+        self.registers, self.hashes = registers, None
+
+    def _add_registers(self, registers: np.ndarray, hashes: np.ndarray) -> None:
+        shift = np.uint64(64 - self.precision)
+        index = (hashes >> shift).astype(np.int64)
+        rest = hashes << np.uint64(self.precision)
+        # Bit length of the remaining bits, exact via 32-bit halves
+        high = np.frexp((rest >> np.uint64(32)).astype(np.float64))[1]
+        low = np.frexp((rest & np.uint64(0xFFFFFFFF)).astype(np.float64))[1]
+        bit_length = np.where(high > 0, high + 32, low)
+        rank = np.minimum(64 - bit_length + 1, 64 - self.precision + 1).astype(np.uint8)
+        np.maximum.at(registers, index, rank)
+
+    def update(self, values) -> 'DistinctSketch':
+        """Add the non-missing values of an array or Series"""
+        values = pd.Series(values).dropna().unique()
+        if len(values) == 0:
+            return self
+        hashes = pd.util.hash_array(np.asarray(values).astype(str).astype(object))
+        if self.registers is None:
+            self.hashes = np.union1d(self.hashes, hashes)
+            if len(self.hashes) > SKETCH_SPARSE_LIMIT:
+                self._densify()
+        else:
+            self._add_registers(self.registers, hashes)
+        return self
+
+    def merge(self, other: 'DistinctSketch') -> 'DistinctSketch':
+        """Fold another sketch of the same precision into this one"""
+        if self.registers is None and other.registers is None:
+            self.hashes = np.union1d(self.hashes, other.hashes)
+            if len(self.hashes) > SKETCH_SPARSE_LIMIT:
+                self._densify()
+            return self
+        if self.registers is None:
+            self._densify()
+        if other.registers is None:
+            self._add_registers(self.registers, other.hashes)
+        else:
+            np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self) -> int:
+        """Estimated number of distinct values"""
+        if self.registers is None:
+            return len(self.hashes)
+        m = len(self.registers)
+        raw = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are empty
+            raw = m * np.log(m / zeros)
+        return int(round(raw))
+
+    def to_dict(self) -> Dict:
+        if self.registers is None:
+            return {'precision': self.precision, 'hashes': _encode_array(self.hashes)}
+        return {'precision': self.precision, 'registers': _encode_array(self.registers)}
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> 'DistinctSketch':
+        sketch = cls(state['precision'])
+        if 'registers' in state:
+            sketch.registers, sketch.hashes = _decode_array(state['registers'], np.uint8), None
+        else:
+            sketch.hashes = _decode_array(state['hashes'], np.uint64)
+        return sketch
+
+class KPIAccumulator:
+    """Mergeable running totals behind the KPI cards.
+
+    Holds the response and rated counts, the rating sum and sum of squares,
+    the promoter and detractor counts, and distinct-count sketches of
+    trainers and courses. ``update`` folds in a chunk of rows and ``merge``
+    another accumulator (another partition, chunk or worker); the state
+    round-trips through ``to_dict``, so KPIs are read in O(1) and kept
+    current in O(new rows).
+    """
+
+    COUNTS = ('responses', 'rated', 'promoters', 'detractors')
+
+    def __init__(self):
+        self.totals = {**dict.fromkeys(self.COUNTS, 0), 'rating_sum': 0.0, 'rating_sq': 0.0}
+        self.sketches = {'trainer': DistinctSketch(), 'course': DistinctSketch()}
+
+    def update(self, df: pd.DataFrame, trainer_col: Optional[str], course_col: Optional[str],
+               rating_col: Optional[str]) -> 'KPIAccumulator':
+        """Add a chunk of delegate rows"""
+        rating = df[rating_col].to_numpy(dtype=np.float64, na_value=np.nan) if rating_col in df.columns else np.empty(0)
+        rated = rating[~np.isnan(rating)]
+        self.totals['responses'] += len(df)
+        self.totals['rated'] += len(rated)
+        self.totals['rating_sum'] += float(rated.sum())
+        self.totals['rating_sq'] += float(np.dot(rated, rated))
+        self.totals['promoters'] += int(np.count_nonzero(rated >= PROMOTER_MIN))
+        self.totals['detractors'] += int(np.count_nonzero(rated <= DETRACTOR_MAX))
+        for key, col in (('trainer', trainer_col), ('course', course_col)):
+            if col in df.columns:
+                self.sketches[key].update(df[col])
+        return self
+
+    def merge(self, other: 'KPIAccumulator') -> 'KPIAccumulator':
+        """Fold another accumulator into this one"""
+        for key, value in other.totals.items():
+            self.totals[key] += value
+        for key, sketch in other.sketches.items():
+            self.sketches[key].merge(sketch)
+        return self
+
+    def kpis(self) -> Dict:
+        """Mean rating, response count, NPS and distinct trainer and course counts"""
+        totals = self.totals
+        rated = totals['rated']
+        return {
+            'overall_rating': totals['rating_sum'] / rated if rated else np.nan,
+            'total_responses': totals['responses'],
+            'nps': (totals['promoters'] - totals['detractors']) / rated * 100 if rated else 0,
+            'trainer_count': self.sketches['trainer'].estimate(),
+            'course_count': self.sketches['course'].estimate(),
+        }
+
+    def to_dict(self) -> Dict:
+        return {'totals': dict(self.totals), 'sketches': {key: sketch.to_dict() for key, sketch in self.sketches.items()}}
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> 'KPIAccumulator':
+        accumulator = cls()
+        accumulator.totals.update(state['totals'])
+        accumulator.sketches.update({key: DistinctSketch.from_dict(sketch) for key, sketch in state['sketches'].items()})
+        return accumulator
+
+def accumulate_kpis(df: pd.DataFrame, trainer_col: Optional[str], course_col: Optional[str], rating_col: Optional[str],
+                    accumulators: Optional[Dict[str, KPIAccumulator]] = None) -> Dict[str, KPIAccumulator]:
+    """Fold rows into per-quarter accumulators keyed by quarter label ('' for rows without a quarter)"""
+    accumulators = {} if accumulators is None else accumulators
+    if 'Quarter' in df.columns:
+        groups = df.groupby('Quarter', dropna=False, observed=True, sort=False).indices
+    else:
+        groups = {None: np.arange(len(df))}
+    for quarter, positions in groups.items():
+        key = '' if pd.isna(quarter) else str(quarter)
+        accumulators.setdefault(key, KPIAccumulator()).update(df.iloc[positions], trainer_col, course_col, rating_col)
+    return accumulators
+
+def merge_kpis(accumulators: Dict[str, KPIAccumulator], quarters: Optional[Tuple[str, str]] = None) -> KPIAccumulator:
+    """One accumulator for an inclusive ``('2024Q1', '2024Q4')`` quarter range; every row when there is no range"""
+    total = KPIAccumulator()
+    for key, accumulator in accumulators.items():
+        # 'YYYYQn' labels of one frequency sort chronologically as strings
+        if quarters is None or (key and quarters[0] <= key <= quarters[1]):
+            total.merge(accumulator)
+    return total
@@ -0,0 +1,348 @@
+"""Shared LLM helpers for the QTS Analytics dashboards."""
+
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ============================================================================
+# RESPONSE CACHE
+# ============================================================================
+
+class ResponseCache:
+    """SQLite cache of LLM responses, shared by reruns, sessions and restarts.
+
+    Entries are keyed by a hash of the provider, model, prompt and sampling
+    parameters. Entries older than ``ttl_seconds`` count as misses and are
+    purged; once the stored text outgrows ``max_bytes`` the least recently
+    used entries are evicted. Callers store only successful responses, so a
+    failed call is retried on the next rerun instead of being replayed.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_bytes: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.enabled = bool(path)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            try:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                self._execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, provider TEXT, model TEXT, response TEXT, "
+                    "size INTEGER, created REAL, accessed REAL)"
+                )
+            except (OSError, sqlite3.Error):
+                self.enabled = False
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        # One short-lived connection per statement; Streamlit runs sessions on different threads
+        with closing(sqlite3.connect(self.path, timeout=5)) as db, db:
+            return db.execute(sql, params).fetchall()
+
+    @staticmethod
+    def key(provider: str, model: str, prompt, params: Dict) -> str:
+        """Hash identifying one request: provider, model, prompt (text or messages) and sampling parameters"""
+        payload = json.dumps([provider, model, prompt, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a stored response that has not expired, or None"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        try:
+            rows = self._execute("SELECT response, created FROM responses WHERE key = ?", (key,))
+            if rows and now - rows[0][1] <= self.ttl_seconds:
+                self._execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                return rows[0][0]
+        except sqlite3.Error:
+            pass
+        self.misses += 1
+        return None
+
+    def put(self, key: str, provider: str, model: str, response: str) -> None:
+        """Store a successful response"""
+        if not self.enabled or not response:
+            return
+        now = time.time()
+        try:
+            self._execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, response, len(response.encode('utf-8')), now, now)
+            )
+        except sqlite3.Error:
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        """Purge expired entries, then least-recently-used ones until the cache fits its cap"""
+        with self._lock:
+            try:
+                self._execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_seconds,))
+                rows = self._execute("SELECT key, size FROM responses ORDER BY accessed")
+                total = sum(size for _, size in rows)
+                stale = []
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    total -= size
+                if stale:
+                    with closing(sqlite3.connect(self.path, timeout=5)) as db, db:
+                        db.executemany("DELETE FROM responses WHERE key = ?", stale)
+            except sqlite3.Error:
+                pass
+
+    def clear(self) -> None:
+        """Delete every stored response"""
+        if self.enabled:
+            try:
+                self._execute("DELETE FROM responses")
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> Dict:
+        """Counters and size for display"""
+        entries, size = 0, 0
+        if self.enabled:
+            try:
+                entries, size = self._execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses")[0]
+            except sqlite3.Error:
+                pass
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': entries,
+            'size_mb': size / 1024 / 1024,
+            'max_mb': self.max_bytes / 1024 / 1024,
+        }
+
+# ============================================================================
+# HTTP SESSIONS
+# ============================================================================
+
+def http_session(pool_size: int) -> requests.Session:
+    """Keep-alive session whose connection pool holds ``pool_size`` connections per host.
+
+    Sharing one session across engine instances and reruns reuses open TCP
+    connections instead of reconnecting for every request; the pool should
+    be at least as large as the number of concurrent requests.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def ollama_available(session, url: str, model: Optional[str] = None, timeout=2) -> bool:
+    """Whether an Ollama server answers at ``url`` (and lists ``model``, when one is given)"""
+    response = session.get(f"{url}/api/tags", timeout=timeout)
+    if response.status_code != 200:
+        return False
+    if model is None:
+        return True
+    names = [entry.get('name', '').split(':')[0] for entry in response.json().get('models', [])]
+    return any(model in name for name in names)
+
+# ============================================================================
+# PROVIDER HEALTH
+# ============================================================================
+
+class HealthCheck:
+    """Provider availability kept fresh by background probes, so page reruns never wait on the network.
+
+    ``available()`` answers from the last probe at once and starts a new
+    probe on a daemon thread once that result is older than
+    ``ttl_seconds``. The first probe starts on construction; until it
+    finishes the provider counts as unavailable (``pending`` is True).
+    ``invalidate()`` marks the provider down after a failed call and
+    re-probes.
+    """
+
+    def __init__(self, probe: Callable[[], bool], ttl_seconds: float):
+        self.probe = probe
+        self.ttl_seconds = ttl_seconds
+        self.status = False
+        self.error = None
+        self.checked_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @property
+    def pending(self) -> bool:
+        """True until the first probe has finished"""
+        return self.checked_at is None
+
+    def refresh(self) -> None:
+        """Start a background probe unless one is already running"""
+        with self._lock:
+            if self._probing:
+                return
+            self._probing = True
+        threading.Thread(target=self._run, name='qts-health', daemon=True).start()
+
+    def _run(self) -> None:
+        try:
+            status, error = bool(self.probe()), None
+        except Exception as e:
+            status, error = False, str(e)
+        with self._lock:
+            self.status, self.error, self.checked_at, self._probing = status, error, time.monotonic(), False
+
+    def available(self) -> bool:
+        """Last known availability; a stale answer is returned while a fresh probe runs"""
+        checked_at = self.checked_at
+        if checked_at is not None and time.monotonic() - checked_at > self.ttl_seconds:
+            self.refresh()
+        return self.status
+
+    def invalidate(self, error: Optional[str] = None) -> None:
+        """Mark the provider down after a failed call and probe it again in the background"""
+        with self._lock:
+            self.status = False
+            if error:
+                self.error = error
+        self.refresh()
+
+# ============================================================================
+# CONCURRENT REQUESTS
+# ============================================================================
+
+def request_concurrency(configured: int, provider_limit: Optional[str] = None) -> int:
+    """Number of LLM requests to run at once: the configured limit, capped by the provider's own.
+
+    ``provider_limit`` is a setting such as ``OLLAMA_NUM_PARALLEL``; more
+    requests than the server runs in parallel would only queue there.
+    """
+    limit = max(1, configured or 1)
+    try:
+        provider = int(provider_limit) if provider_limit else 0
+    except ValueError:
+        provider = 0
+    return min(limit, provider) if provider > 0 else limit
+
+def stream_concurrently(tasks: Dict[Hashable, Callable[[Callable[[str], None]], Optional[str]]],
+                        max_workers: int) -> Iterator[Tuple[Hashable, Optional[str], bool, Optional[Exception]]]:
+    """Run streaming tasks on a bounded thread pool, yielding ``(key, text, done, error)`` updates.
+
+    Each task is called with an ``emit(text_so_far)`` callback and returns
+    its final text. Updates are yielded on the calling thread, so Streamlit
+    placeholders can be redrawn there while other requests are in flight;
+    partial updates that pile up between redraws collapse to the latest
+    text per task. Closing the generator early cancels the tasks that have
+    not started and does not wait for the running ones.
+    """
+    if not tasks:
+        return
+    updates = queue.Queue()
+    
+    def run(key, task):
+        try:
+            result = task(lambda text: updates.put((key, text, False, None)))
+            updates.put((key, result, True, None))
+        except Exception as e:
+            updates.put((key, None, True, e))
+    
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks))), thread_name_prefix='qts-ai')
+    try:
+        for key, task in tasks.items():
+            pool.submit(run, key, task)
+        remaining = len(tasks)
+        while remaining:
+            batch = [updates.get()]
+            while True:
+                try:
+                    batch.append(updates.get_nowait())
+                except queue.Empty:
+                    break
+            finished = [update for update in batch if update[2]]
+            done_keys = {update[0] for update in finished}
+            partial = {update[0]: update for update in batch if not update[2] and update[0] not in done_keys}
+            for update in list(partial.values()) + finished:
+                remaining -= update[2]
+                yield update
+    finally:
+        # A rerun or stop closes this generator early: drop queued requests rather than wait for them
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# ============================================================================
+# STREAMED RESPONSES
+# ============================================================================
+
+def read_ollama_stream(response, on_token: Optional[Callable[[str], None]] = None,
+                       started: Optional[float] = None) -> Tuple[str, Optional[float]]:
+    """Collect an Ollama ``/api/generate`` NDJSON stream, passing the text so far to ``on_token``.
+
+    Returns the full text and the seconds from ``started`` to the first
+    token (None when no token arrived).
+    """
+    started = time.time() if started is None else started
+    parts, first_token = [], None
+    # Ollama sends each chunk as it is generated; chunk_size=None hands them over without waiting to fill a buffer
+    for line in response.iter_lines(chunk_size=None):
+        if not line:
+            continue
+        chunk = json.loads(line)
+        if 'error' in chunk:
+            raise RuntimeError(chunk['error'])
+        token = chunk.get('response', '')
+        if token:
+            if first_token is None:
+                first_token = time.time() - started
+            parts.append(token)
+            if on_token is not None:
+                on_token(''.join(parts))
+        if chunk.get('done'):
+            break
+    return ''.join(parts), first_token
+
+def read_openai_stream(stream, on_token: Optional[Callable[[str], None]] = None,
+                       started: Optional[float] = None) -> Tuple[str, Optional[float]]:
+    """Collect an OpenAI chat completion created with ``stream=True``, like ``read_ollama_stream``"""
+    started = time.time() if started is None else started
+    parts, first_token = [], None
+    for chunk in stream:
+        token = chunk.choices[0].delta.content if chunk.choices else None
+        if token:
+            if first_token is None:
+                first_token = time.time() - started
+            parts.append(token)
+            if on_token is not None:
+                on_token(''.join(parts))
+    return ''.join(parts), first_token
+
+def timing_summary(timings: List[Dict]) -> Dict:
+    """Request counts and median latencies of an engine's ``timings`` records.
+
+    ``headers`` is the time until the response headers arrived, which is
+    mostly connection and request overhead for streamed responses.
+    """
+    live = [timing for timing in timings if not timing['cached']]
+    
+    def median(key):
+        values = sorted(timing[key] for timing in live if timing.get(key) is not None)
+        return values[len(values) // 2] if values else None
+    
+    return {
+        'requests': len(timings),
+        'cached': len(timings) - len(live),
+        'headers': median('headers'),
+        'first_token': median('first_token'),
+        'total': median('total'),
+    }
@@ -0,0 +1,1113 @@
+"""Shared workbook ingestion helpers for the QTS Analytics dashboards."""
+
+import calendar
+import datetime
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Parquet support for the ingest cache
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# ============================================================================
+# WORKBOOK READER
+# ============================================================================
+
+def read_upload_bytes(uploaded_file) -> bytes:
+    """Return the raw bytes of an uploaded file without consuming the handle"""
+    if isinstance(uploaded_file, (bytes, bytearray)):
+        return bytes(uploaded_file)
+    if hasattr(uploaded_file, 'getvalue'):
+        return uploaded_file.getvalue()
+    position = uploaded_file.tell()
+    data = uploaded_file.read()
+    uploaded_file.seek(position)
+    return data
+
+def read_workbook(source, plan: Optional[Dict] = None) -> Dict[str, pd.DataFrame]:
+    """Parse the sheets of a workbook from a single open handle.
+
+    ``pd.read_excel(file, sheet_name=name)`` re-opens and re-parses the whole
+    workbook on every call, so looping over sheet names costs one full parse
+    per sheet. ``ExcelFile`` loads the workbook once and parses sheets from it.
+    ``plan`` maps the sheets to load to the columns to keep (None = all
+    columns); without a plan every sheet is loaded in full.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with pd.ExcelFile(source) as excel_file:
+        if plan is None:
+            return {sheet_name: excel_file.parse(sheet_name) for sheet_name in excel_file.sheet_names}
+        return {
+            sheet_name: _parse_sheet(excel_file, sheet_name, plan[sheet_name])
+            for sheet_name in excel_file.sheet_names if sheet_name in plan
+        }
+
+def _parse_sheet(excel_file: pd.ExcelFile, sheet_name: str, columns: Optional[List]) -> pd.DataFrame:
+    """Parse one sheet, keeping only ``columns`` when given"""
+    if columns is None:
+        return excel_file.parse(sheet_name)
+    wanted = {str(col) for col in columns}
+    return excel_file.parse(sheet_name, usecols=lambda col: str(col) in wanted)
+
+def timed_read_workbook(filename: str, source, plan: Optional[Dict] = None) -> Tuple[Dict[str, pd.DataFrame], Dict]:
+    """Read a workbook and report how long the parse took"""
+    started = time.perf_counter()
+    sheets = read_workbook(source, plan)
+    timing = {
+        'file': filename,
+        'sheets': len(sheets),
+        'rows': sum(len(df) for df in sheets.values()),
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+    return sheets, timing
+
+# ============================================================================
+# STREAMING READER
+# ============================================================================
+
+# Strings pd.read_excel treats as missing by default
+EXCEL_NA_VALUES = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+}
+
+def is_xlsx(data: bytes) -> bool:
+    """openpyxl can only stream zip-based workbooks (.xlsx), not legacy .xls"""
+    return data[:2] == b'PK'
+
+def _header_names(values) -> List:
+    """Build column names the way pd.read_excel does (Unnamed: n, dup.1, ...)"""
+    names = list(values)
+    while names and names[-1] is None:
+        names.pop()
+    names = [f"Unnamed: {position}" if name is None else name for position, name in enumerate(names)]
+    
+    counts = {}
+    for position, name in enumerate(names):
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        names[position] = name
+        counts[name] = count + 1
+    return names
+
+def _cell_value(value):
+    """Normalise a raw openpyxl cell value like pandas' Excel reader"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value in EXCEL_NA_VALUES:
+        return None
+    return value
+
+def _chunk_frame(rows: List[tuple], headers: List) -> pd.DataFrame:
+    """Turn buffered rows into a typed DataFrame chunk"""
+    df = pd.DataFrame.from_records(rows, columns=headers)
+    for col in df.columns:
+        if df[col].dtype == object:
+            try:
+                df[col] = pd.to_numeric(df[col])
+            except (ValueError, TypeError):
+                pass
+    return df
+
+def _iter_sheet_chunks(worksheet, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Yield a read-only worksheet as DataFrames of at most ``chunk_rows`` rows"""
+    rows = worksheet.iter_rows(values_only=True)
+    headers = None
+    for values in rows:
+        if any(value is not None for value in values):
+            headers = _header_names(values)
+            break
+    if not headers:
+        return
+    
+    width = len(headers)
+    buffer = []
+    for values in rows:
+        row = tuple(_cell_value(value) for value in values[:width])
+        if all(value is None for value in row):
+            continue
+        buffer.append(row + (None,) * (width - len(row)))
+        if len(buffer) >= chunk_rows:
+            yield _chunk_frame(buffer, headers)
+            buffer = []
+    if buffer:
+        yield _chunk_frame(buffer, headers)
+
+def stream_workbook(source, chunk_rows: int = 50_000) -> Iterator[Tuple[str, Iterator[pd.DataFrame]]]:
+    """Stream every sheet of an .xlsx workbook in bounded-size chunks.
+
+    Uses openpyxl's ``read_only`` mode, which iterates rows straight from the
+    sheet XML instead of building the full cell object model, so memory is
+    bounded by ``chunk_rows`` rather than by the size of the sheet. Each
+    sheet's chunk iterator must be consumed before moving to the next sheet.
+    """
+    from openpyxl import load_workbook
+    
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            yield worksheet.title, _iter_sheet_chunks(worksheet, chunk_rows)
+    finally:
+        workbook.close()
+
+# ============================================================================
+# HEADER SNIFFING
+# ============================================================================
+
+def _sniff_sheet(worksheet) -> Dict:
+    """Header names and approximate data row count of one read-only worksheet"""
+    header_row = 0
+    headers = []
+    for row_number, values in enumerate(worksheet.iter_rows(values_only=True), start=1):
+        if any(value is not None for value in values):
+            header_row = row_number
+            headers = _header_names(values)
+            break
+    
+    rows = 0
+    if headers:
+        # max_row comes from the sheet's <dimension> tag, so no data is read.
+        # Writers that omit or under-report it get an actual row count.
+        max_row = worksheet.max_row
+        if max_row is not None and max_row > header_row:
+            rows = max_row - header_row
+        else:
+            rows = sum(
+                1 for values in worksheet.iter_rows(min_row=header_row + 1, values_only=True)
+                if any(value is not None for value in values)
+            )
+    return {'name': worksheet.title, 'columns': headers, 'rows': rows}
+
+def sniff_workbook(source) -> List[Dict]:
+    """Read just the header row and dimensions of every sheet of an .xlsx.
+
+    Returns ``{'name', 'columns', 'rows'}`` per sheet in workbook order, which
+    is enough to classify sheets before paying for a full parse. ``rows`` is
+    taken from the sheet dimensions and may include trailing blank rows.
+    """
+    from openpyxl import load_workbook
+    
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        return [_sniff_sheet(worksheet) for worksheet in workbook.worksheets]
+    finally:
+        workbook.close()
+
+# ============================================================================
+# COMPACT COLUMN TYPES
+# ============================================================================
+
+def categorical_candidates(df: pd.DataFrame, max_ratio: float = 0.5) -> List:
+    """Text columns repetitive enough to be worth storing as categoricals"""
+    candidates = []
+    for col in df.columns:
+        if pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col]):
+            values = df[col].dropna()
+            if len(values) and values.map(type).eq(str).all() and values.nunique() <= max_ratio * len(values):
+                candidates.append(col)
+    return candidates
+
+def compact_frame(df: pd.DataFrame, categorical_columns: Optional[List] = None) -> pd.DataFrame:
+    """Downcast numeric columns losslessly and dictionary-encode text columns.
+
+    Only signed integers are downcast: a uint64 chunk (such as
+    Row_Fingerprint) whose values happen to fit int64 would turn signed,
+    and concatenating it with unsigned chunks would give float64.
+    """
+    if categorical_columns is None:
+        categorical_columns = categorical_candidates(df)
+    for col in df.columns:
+        series = df[col]
+        if col in categorical_columns and not isinstance(series.dtype, pd.CategoricalDtype):
+            df[col] = series.astype('category')
+        elif (col != FINGERPRINT_COLUMN and pd.api.types.is_signed_integer_dtype(series)
+              and not pd.api.types.is_extension_array_dtype(series)):
+            df[col] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series) and series.dtype != np.float32:
+            narrowed = series.astype(np.float32)
+            if np.array_equal(narrowed.astype(np.float64).to_numpy(), series.to_numpy(), equal_nan=True):
+                df[col] = narrowed
+    return df
+
+def encode_categories(df: pd.DataFrame, columns: Optional[List] = None, max_ratio: float = 0.5,
+                      subset: Optional[List] = None) -> List:
+    """Dictionary-encode text columns as categoricals, in place.
+
+    ``columns`` (e.g. trainer and course) are always encoded when they hold
+    text; any other text column is encoded when it is repetitive enough
+    (see ``categorical_candidates``). Filters and groupbys on the result
+    compare integer codes instead of strings. ``subset`` limits the scan to
+    those columns (e.g. the ones an append added). Returns the encoded
+    columns.
+    """
+    # Columns that are already categorical (e.g. after an append) are not rescanned
+    scanned = df.columns if subset is None else [col for col in df.columns if col in subset]
+    plain = [col for col in scanned if not isinstance(df[col].dtype, pd.CategoricalDtype)]
+    forced = [col for col in dict.fromkeys(columns or []) if col is not None and col in plain]
+    targets = categorical_candidates(df[forced], max_ratio=1.0) if forced else []
+    targets += [col for col in categorical_candidates(df[plain], max_ratio) if col not in targets]
+    for col in targets:
+        df[col] = df[col].astype('category')
+    return targets
+
+def memory_report(before: pd.Series, df: pd.DataFrame) -> pd.DataFrame:
+    """Per-column memory before and after compaction, from ``memory_usage(deep=True)``"""
+    after = df.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        'dtype': df.dtypes.astype(str),
+        'before_kb': before.reindex(after.index) / 1024,
+        'after_kb': after / 1024,
+    })
+    return report.round(1)
+
+def coerce_scores(df: pd.DataFrame, columns: List, min_numeric_share: float = 0.5) -> List:
+    """Convert score columns to numbers once, stored as float32 wherever that is exact.
+
+    A column is converted when at least ``min_numeric_share`` of its filled
+    cells are numbers, so a free-text column that happens to match a metric
+    keyword keeps its text. Unparseable cells become NaN. Returns the
+    columns that hold numbers afterwards.
+    """
+    numeric = []
+    for col in dict.fromkeys(columns):
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        numbers = pd.to_numeric(values, errors='coerce')
+        filled = values.notna().sum()
+        if filled and numbers.notna().sum() < min_numeric_share * filled:
+            continue
+        numbers = numbers.astype(np.float64)
+        narrowed = numbers.astype(np.float32)
+        exact = np.array_equal(narrowed.astype(np.float64).to_numpy(), numbers.to_numpy(), equal_nan=True)
+        df[col] = narrowed if exact else numbers
+        numeric.append(col)
+    return numeric
+
+def concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate chunks without losing categorical dtypes to object"""
+    frames = [df for df in frames if df is not None]
+    if len(frames) == 1:
+        return frames[0]
+    
+    shared = set(frames[0].columns).intersection(*[df.columns for df in frames[1:]])
+    for col in shared:
+        dtypes = [df[col].dtype for df in frames]
+        if not all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+            continue
+        # Frames that already share their categories (e.g. conformed appends) are not recoded
+        if all(dtype.categories.equals(dtypes[0].categories) for dtype in dtypes[1:]):
+            continue
+        categories = pd.Index([])
+        for df in frames:
+            categories = categories.union(df[col].cat.categories, sort=False)
+        for df in frames:
+            df[col] = df[col].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+# ============================================================================
+# VECTORIZED DATE PARSING
+# ============================================================================
+
+def _parse_free(date_str: str):
+    """Last-resort parse of a single value, as pd.to_datetime infers it"""
+    try:
+        return pd.to_datetime(date_str)
+    except Exception:
+        return None
+
+def parse_dates(values: pd.Series, formats: List[str]) -> pd.Series:
+    """Parse a whole column the way trying ``formats`` cell by cell would.
+
+    Equivalent to stripping ``str(value)``, taking the first format in
+    ``formats`` that parses it, and falling back to a free-form
+    ``pd.to_datetime``. Only distinct strings are parsed, each format runs
+    once over whatever the formats before it left unparsed, and only the
+    final leftovers are parsed one at a time. Formats must run in priority
+    order: trying a more common format first would turn '05/01/2024' into
+    1 May instead of 5 January.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.copy()
+    
+    unparsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[us]')
+    present = values.dropna()
+    if present.empty:
+        return unparsed
+    
+    # Cells Excel already typed as dates survive the str() round trip unchanged
+    is_date = present.map(lambda value: isinstance(value, datetime.date))
+    text = present[~is_date].map(str).str.strip()
+    
+    uniques = pd.Series(text.unique(), dtype=object)
+    parsed = [None] * len(uniques)
+    remaining = uniques
+    for fmt in formats:
+        if remaining.empty:
+            break
+        converted = pd.to_datetime(remaining, format=fmt, errors='coerce')
+        hit = converted.notna()
+        for position, value in converted[hit].items():
+            parsed[position] = value
+        remaining = remaining[~hit]
+    for position, date_str in remaining.items():
+        parsed[position] = _parse_free(date_str)
+    
+    result = pd.Series(None, index=present.index, dtype=object)
+    result[~is_date] = text.map(pd.Series(parsed, index=uniques, dtype=object))
+    if is_date.any():
+        result[is_date] = present[is_date].map(pd.Timestamp)
+    if result.isna().all():
+        return unparsed
+    return pd.to_datetime(result).reindex(values.index)
+
+# ============================================================================
+# SCHEMA-ALIGNED MERGE
+# ============================================================================
+
+def normalize_header(name) -> str:
+    """Comparison key for a header: surrounding and repeated whitespace dropped, case folded"""
+    return ' '.join(str(name).split()).casefold()
+
+def _is_text(series: pd.Series) -> bool:
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return pd.api.types.infer_dtype(series.cat.categories, skipna=True) in ('string', 'empty')
+    if pd.api.types.is_string_dtype(series) or series.dtype == object:
+        return pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty')
+    return False
+
+def _shared_dtype(columns: List[pd.Series], complete: bool):
+    """A dtype every frame's copy of one column can be cast to without loss.
+
+    Copies that are entirely empty do not vote. ``complete`` is False when
+    some frame lacks the column, which then has to hold missing values.
+    """
+    filled = [series for series in columns if series.notna().any()] or columns[:1]
+    dtypes = [series.dtype for series in filled]
+    holes = not complete or len(filled) < len(columns)
+    
+    if all(dtype == dtypes[0] for dtype in dtypes):
+        dtype = dtypes[0]
+        if holes and pd.api.types.is_bool_dtype(dtype) and not pd.api.types.is_extension_array_dtype(dtype):
+            return np.dtype(object)
+        if holes and pd.api.types.is_integer_dtype(dtype) and not pd.api.types.is_extension_array_dtype(dtype):
+            return np.dtype(np.float64)
+        return dtype
+    if all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+        return 'category'
+    if any(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes) and all(_is_text(series) for series in filled):
+        # Keep a dictionary-encoded column encoded when plain text is added to it
+        return 'category'
+    if all(pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype) for dtype in dtypes):
+        return np.dtype(np.float64)
+    if all(pd.api.types.is_datetime64_dtype(dtype) for dtype in dtypes):
+        return np.dtype('datetime64[us]')
+    if all(_is_text(series) for series in filled):
+        return pd.StringDtype(na_value=np.nan)
+    return np.dtype(object)
+
+def align_frames(frames: List[pd.DataFrame]) -> Tuple[List[pd.DataFrame], List[Dict]]:
+    """Map frames onto one canonical set of columns, each with one shared dtype.
+
+    Headers that differ only in spacing or case are the same column, named
+    after its first spelling (trimmed) in upload order. Every frame gets
+    every canonical column, cast to the dtype chosen by ``_shared_dtype``,
+    so concatenating them neither spreads one field over near-duplicate
+    columns nor falls back to object. Returns the aligned frames and one
+    log entry per canonical column listing the headers merged into it.
+    """
+    canonical = {}
+    spellings = {}
+    renamed = []
+    for df in frames:
+        mapping = {}
+        seen = set()
+        for col in df.columns:
+            key = normalize_header(col)
+            if key in seen:
+                # Two headers of one sheet collapse to the same key: keep both as they are
+                continue
+            seen.add(key)
+            name = canonical.setdefault(key, col.strip() if isinstance(col, str) else col)
+            variants = spellings.setdefault(key, [])
+            if col not in variants:
+                variants.append(col)
+            if col != name:
+                mapping[col] = name
+        renamed.append(df.rename(columns=mapping) if mapping else df)
+    
+    columns = list(dict.fromkeys(col for df in renamed for col in df.columns))
+    targets = {}
+    for col in columns:
+        copies = [df[col] for df in renamed if col in df.columns]
+        if any(isinstance(copy, pd.DataFrame) for copy in copies):
+            targets[col] = None
+            continue
+        targets[col] = _shared_dtype(copies, complete=len(copies) == len(renamed))
+    
+    aligned = []
+    for df in renamed:
+        df = df.copy()
+        for col in columns:
+            target = targets[col]
+            if col not in df.columns:
+                df[col] = pd.Series(np.nan, index=df.index, dtype=object)
+            elif target is None or df[col].dtype == target:
+                continue
+            try:
+                df[col] = df[col].astype(target)
+            except (TypeError, ValueError):
+                df[col] = df[col].astype(object)
+        aligned.append(df[columns])
+    
+    log = []
+    for key, name in canonical.items():
+        dtypes = {str(df[name].dtype) for df in aligned if not isinstance(df[name], pd.DataFrame)}
+        log.append({
+            'column': name,
+            'merged_from': ' | '.join(repr(variant) for variant in spellings[key]),
+            'sheets': sum(1 for df in frames if any(normalize_header(col) == key for col in df.columns)),
+            'dtype': ', '.join(sorted(dtypes)),
+        })
+    return aligned, log
+
+# ============================================================================
+# ROW FINGERPRINTS
+# ============================================================================
+
+FINGERPRINT_COLUMN = 'Row_Fingerprint'
+
+# Columns derived at ingest, which never take part in a row's identity
+DERIVED_COLUMNS = ('Parsed_Date', 'Quarter', FINGERPRINT_COLUMN)
+
+def _column_salt(name) -> np.uint64:
+    """Stable 64-bit hash of a normalised column name"""
+    digest = hashlib.sha256(normalize_header(name).encode('utf-8')).digest()
+    return np.uint64(int.from_bytes(digest[:8], 'little'))
+
+def _cell_hashes(series: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """Hash every cell after normalising it; returns (hashes, missing mask).
+
+    Numbers hash as float64 so 5 and 5.0 agree across files, and blank
+    strings count as missing. Values of text-only columns are stripped;
+    mixed-type object columns hash their text as it is. Text is hashed once
+    per distinct value.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype) and not pd.api.types.is_numeric_dtype(series.cat.categories):
+        codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+    elif pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        return pd.util.hash_array(series.astype(np.float64).to_numpy()), series.isna().to_numpy()
+    elif pd.api.types.is_datetime64_any_dtype(series):
+        return pd.util.hash_array(series.dt.as_unit('ns').array.asi8), series.isna().to_numpy()
+    else:
+        codes, uniques = pd.factorize(series)
+    
+    if len(uniques) == 0:
+        return np.zeros(len(series), dtype=np.uint64), np.ones(len(series), dtype=bool)
+    uniques = pd.Series(uniques, dtype=object)
+    if pd.api.types.infer_dtype(uniques, skipna=True) == 'string':
+        uniques = uniques.str.strip()
+    hashes = pd.util.hash_array(uniques.fillna('').to_numpy())
+    blank = np.append(uniques.isna().to_numpy() | uniques.eq('').to_numpy(), True)
+    return hashes.take(codes, mode='clip'), blank[codes]
+
+def row_fingerprints(df: pd.DataFrame, exclude=DERIVED_COLUMNS) -> np.ndarray:
+    """Stable 64-bit fingerprint of every row's normalised cells.
+
+    Each filled cell is hashed together with its column name and the
+    results are summed, so neither column order nor empty columns change a
+    row's fingerprint. Rows from files with the same values therefore match
+    even if one export added or reordered columns.
+    """
+    total = np.zeros(len(df), dtype=np.uint64)
+    for position, col in enumerate(df.columns):
+        if col in exclude:
+            continue
+        hashes, missing = _cell_hashes(df.iloc[:, position])
+        if missing.all():
+            continue
+        cells = pd.util.hash_array(hashes ^ _column_salt(col))
+        cells[missing] = 0
+        total += cells
+    return total
+
+def add_fingerprints(df: pd.DataFrame, exclude=DERIVED_COLUMNS) -> pd.DataFrame:
+    """Store each row's fingerprint in the Row_Fingerprint column"""
+    df[FINGERPRINT_COLUMN] = row_fingerprints(df, exclude)
+    return df
+
+def without_fingerprints(df: pd.DataFrame) -> pd.DataFrame:
+    """The frame without its Row_Fingerprint column, for display and export"""
+    return df.drop(columns=FINGERPRINT_COLUMN) if FINGERPRINT_COLUMN in df.columns else df
+
+def dataset_fingerprint(df: pd.DataFrame, *context) -> str:
+    """Digest of a frame's rows, independent of their order, plus any JSON-able context.
+
+    Combines the Row_Fingerprint column (hashed first if absent) with the
+    row count, so two sessions holding the same data get the same key.
+    """
+    hashes = df[FINGERPRINT_COLUMN] if FINGERPRINT_COLUMN in df.columns else row_fingerprints(df)
+    values = np.asarray(hashes, dtype=np.uint64)
+    digest = hashlib.sha256()
+    digest.update(np.array([len(values), values.sum(dtype=np.uint64), np.bitwise_xor.reduce(values) if len(values) else 0],
+                           dtype=np.uint64).tobytes())
+    digest.update(json.dumps(context, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+def drop_duplicate_rows(frames: List[pd.DataFrame]) -> Tuple[pd.DataFrame, List[int]]:
+    """Concatenate frames, keeping the first row seen for every fingerprint.
+
+    Frames that already carry Row_Fingerprint (e.g. data merged earlier)
+    are not hashed again. Returns the merged frame and the number of
+    duplicate rows dropped from each input frame.
+    """
+    for df in frames:
+        if FINGERPRINT_COLUMN not in df.columns:
+            add_fingerprints(df)
+    merged = concat_frames(list(frames))
+    duplicated = merged[FINGERPRINT_COLUMN].duplicated().to_numpy()
+    owner = np.repeat(np.arange(len(frames)), [len(df) for df in frames])
+    counts = np.bincount(owner[duplicated], minlength=len(frames))
+    return merged.loc[~duplicated].reset_index(drop=True), counts.tolist()
+
+def _fits(columns: List[pd.Series], dtype) -> bool:
+    """Whether every new copy of a column casts to an existing column's dtype without losing values"""
+    for series in columns:
+        if series.dtype == dtype:
+            continue
+        if dtype == object:
+            continue
+        if pd.api.types.is_string_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype) and _is_text(series):
+            continue
+        if pd.api.types.is_datetime64_dtype(dtype) and pd.api.types.is_datetime64_dtype(series.dtype):
+            continue
+        numeric = [pd.api.types.is_numeric_dtype(kind) and not pd.api.types.is_bool_dtype(kind) for kind in (series.dtype, dtype)]
+        if not all(numeric):
+            return False
+        try:
+            cast = series.astype(dtype)
+        except (TypeError, ValueError):
+            return False
+        if not np.array_equal(cast.astype(np.float64).to_numpy(), series.astype(np.float64).to_numpy(), equal_nan=True):
+            return False
+    return True
+
+def _without_missing(dtype) -> bool:
+    """Whether a dtype has no missing value of its own (numpy integers and booleans)"""
+    return (pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype)) \
+        and not pd.api.types.is_extension_array_dtype(dtype)
+
+def _cast_column(df: pd.DataFrame, col, dtype) -> None:
+    """Cast one column in place, adding it as missing values when the frame lacks it"""
+    if col not in df.columns:
+        df[col] = pd.Series(np.nan, index=df.index, dtype=object)
+    elif df[col].dtype == dtype:
+        return
+    try:
+        df[col] = df[col].astype(dtype)
+    except (TypeError, ValueError):
+        df[col] = df[col].astype(object)
+
+def conform_frames(existing: pd.DataFrame, frames: List[pd.DataFrame]) -> Tuple[pd.DataFrame, List[pd.DataFrame], List[Dict]]:
+    """Cast new frames onto an existing frame's columns and dtypes, leaving its rows alone.
+
+    ``frames`` are expected to be aligned with each other already (see
+    ``align_frames``). New headers that differ from an existing one only in
+    spacing or case take its name. New text in a categorical column extends
+    its categories, and other new values are cast to the existing dtype
+    when they fit it losslessly; only a column whose new values do not fit
+    is widened across the existing rows. Returns a shallow copy of the
+    existing frame, the conformed frames and an ``align_frames`` style log.
+    """
+    existing = existing.copy(deep=False)
+    names = {}
+    for col in existing.columns:
+        names.setdefault(normalize_header(col), col)
+    spellings = {key: [name] for key, name in names.items()}
+    
+    conformed = []
+    for df in frames:
+        mapping = {}
+        for col in df.columns:
+            key = normalize_header(col)
+            name = names.get(key)
+            if name is None:
+                spellings.setdefault(key, [col])
+                continue
+            if col not in spellings[key]:
+                spellings[key].append(col)
+            if col != name and name not in df.columns:
+                mapping[col] = name
+        conformed.append(df.rename(columns=mapping) if mapping else df.copy(deep=False))
+    sheets = {}
+    for df in [existing] + conformed:
+        for col in df.columns:
+            sheets[col] = sheets.get(col, 0) + 1
+    
+    for col in existing.columns:
+        current = existing[col]
+        copies = [df[col] for df in conformed if col in df.columns]
+        if isinstance(current, pd.DataFrame) or any(isinstance(copy, pd.DataFrame) for copy in copies):
+            continue
+        filled = [copy for copy in copies if copy.notna().any()]
+        holes = len(filled) < len(conformed)
+        if isinstance(current.dtype, pd.CategoricalDtype) and all(_is_text(copy) for copy in filled):
+            if filled:
+                values = pd.Index(pd.concat([copy.astype(object).dropna() for copy in filled]).unique())
+                extra = values.difference(current.cat.categories, sort=False)
+                if len(extra):
+                    existing[col] = current = current.cat.add_categories(extra)
+            target = current.dtype
+        elif _fits(filled, current.dtype) and not (holes and _without_missing(current.dtype)):
+            target = current.dtype
+        else:
+            # Only this column of the existing rows is rewritten
+            sample = current[current.notna().to_numpy()].iloc[:100]
+            target = _shared_dtype([sample] + filled, complete=not holes)
+            try:
+                existing[col] = current.astype(target)
+            except (TypeError, ValueError):
+                existing[col] = current.astype(object)
+                target = np.dtype(object)
+        for df in conformed:
+            _cast_column(df, col, target)
+    
+    added = [col for col in (conformed[0].columns if conformed else []) if col not in existing.columns]
+    for col in added:
+        copies = [df[col] for df in conformed]
+        if any(isinstance(copy, pd.DataFrame) for copy in copies):
+            continue
+        target = _shared_dtype(copies, complete=False)
+        _cast_column(existing, col, target)
+        for df in conformed:
+            _cast_column(df, col, existing[col].dtype)
+    
+    log = []
+    for key, variants in spellings.items():
+        name = names.get(key, variants[0])
+        source = existing if name in existing.columns else next(df for df in conformed if name in df.columns)
+        log.append({
+            'column': name,
+            'merged_from': ' | '.join(repr(variant) for variant in variants),
+            'sheets': sheets.get(name, 0),
+            'dtype': str(source[name].dtype) if not isinstance(source[name], pd.DataFrame) else 'object',
+        })
+    return existing, conformed, log
+
+def append_unique_rows(existing: pd.DataFrame, frames: List[pd.DataFrame]) -> Tuple[pd.DataFrame, List[int], List[Dict]]:
+    """Append new frames to already deduplicated data, keeping only rows it does not hold.
+
+    New rows are matched on Row_Fingerprint against the existing rows and
+    each other, so existing data that carries fingerprints is not hashed
+    again. Only the new rows are aligned and cast to its schema (see
+    ``conform_frames``); the existing rows are copied once, by the final
+    concatenation. Returns the merged frame, the duplicates dropped from
+    each new frame and the column alignment log.
+    """
+    if FINGERPRINT_COLUMN not in existing.columns:
+        existing = existing.assign(**{FINGERPRINT_COLUMN: row_fingerprints(existing)})
+    for df in frames:
+        if FINGERPRINT_COLUMN not in df.columns:
+            add_fingerprints(df)
+    
+    fresh = pd.concat([df[FINGERPRINT_COLUMN] for df in frames], ignore_index=True)
+    duplicated = (fresh.duplicated() | fresh.isin(existing[FINGERPRINT_COLUMN])).to_numpy()
+    owner = np.repeat(np.arange(len(frames)), [len(df) for df in frames])
+    counts = np.bincount(owner[duplicated], minlength=len(frames))
+    kept = [df.loc[~duplicated[owner == position]] for position, df in enumerate(frames)]
+    
+    aligned, _ = align_frames(kept)
+    existing, conformed, log = conform_frames(existing, aligned)
+    return concat_frames([existing] + conformed), counts.tolist(), log
+
+# ============================================================================
+# COLUMN SCHEMA
+# ============================================================================
+
+# Header keywords for each column role; the first matching column wins
+ROLE_KEYWORDS = {
+    'trainer': ['tutor', 'trainer', 'presenter'],
+    'course': ['course'],
+    'date': ['date', 'completion', 'submitted', 'time'],
+    'comment': ['comment', 'feedback'],
+}
+
+def load_schema_mapping(path: Optional[str]) -> Dict:
+    """Read a user-supplied JSON mapping of roles to column names.
+
+    e.g. ``{"trainer": "Facilitator", "rating": "Overall score",
+    "metrics": {"knowledge": "Subject expertise"}}``. Roles left out are
+    detected from the headers as usual.
+    """
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        mapping = json.load(f)
+    if not isinstance(mapping, dict):
+        raise ValueError("schema mapping must be a JSON object")
+    return mapping
+
+def match_columns(columns, keywords: Dict[str, List[str]], mapping: Optional[Dict] = None) -> Dict:
+    """First column whose header contains one of each role's keywords.
+
+    A role named in ``mapping`` uses the mapped column instead, as long as
+    that column exists.
+    """
+    columns = list(columns)
+    mapping = mapping or {}
+    resolved = {}
+    for role, role_keywords in keywords.items():
+        mapped = mapping.get(role)
+        if mapped is not None and mapped in columns:
+            resolved[role] = mapped
+            continue
+        resolved[role] = next(
+            (col for col in columns if any(kw in str(col).lower() for kw in role_keywords)),
+            None
+        )
+    return resolved
+
+def resolve_schema(columns, rating_column: str, metric_keywords: Optional[Dict[str, List[str]]] = None,
+                   mapping: Optional[Dict] = None) -> Dict:
+    """Decide once which column plays each role in the delegate data.
+
+    Returns ``{'trainer', 'course', 'rating', 'date', 'comment', 'metrics'}``
+    where each role is a column name or None, and ``metrics`` maps the
+    sub-metric names in ``metric_keywords`` to the columns found for them.
+    """
+    columns = list(columns)
+    mapping = mapping or {}
+    schema = match_columns(columns, ROLE_KEYWORDS, mapping)
+    rating = mapping.get('rating', rating_column)
+    schema['rating'] = rating if rating in columns else None
+    metrics = match_columns(columns, metric_keywords or {}, mapping.get('metrics'))
+    schema['metrics'] = {name: col for name, col in metrics.items() if col is not None}
+    return schema
+
+# ============================================================================
+# QUARTERS
+# ============================================================================
+
+def quarter_frequency(fiscal_year_start_month: int = 1) -> str:
+    """Pandas quarterly frequency for a year starting in the given month (1 = calendar year)"""
+    end_month = (fiscal_year_start_month - 2) % 12 + 1
+    return f"Q-{calendar.month_abbr[end_month].upper()}"
+
+def assign_quarters(dates: pd.Series, fiscal_year_start_month: int = 1) -> pd.Series:
+    """Quarter of every date as a Period column, which sorts and groups chronologically.
+
+    Fiscal years are named after the calendar year they end in, so with an
+    April start 15 April 2024 falls in Q1 of FY2025.
+    """
+    return pd.to_datetime(dates).dt.to_period(quarter_frequency(fiscal_year_start_month))
+
+def quarter_labels(quarters: pd.Series, fiscal_year_start_month: int = 1) -> pd.Series:
+    """Display labels for a Period column: 'Q1 2024', or 'Q1 FY2025' for a fiscal year"""
+    return quarters.dt.strftime('Q%q %Y' if fiscal_year_start_month == 1 else 'Q%q FY%F')
+
+# ============================================================================
+# CONTENT-ADDRESSED INGEST CACHE
+# ============================================================================
+
+class IngestCache:
+    """On-disk Parquet cache of sniffed headers and parsed sheets, keyed by workbook bytes.
+
+    Each workbook has a JSON manifest (``<sha256>.json``) holding its header
+    sniff, plus one Parquet file per loaded sheet and column selection
+    (``<sha256>-<sheet hash>.parquet``). A full hit skips openpyxl entirely.
+    Entries are evicted least-recently-used once the directory grows past
+    ``max_bytes``; hits refresh the mtime.
+    """
+    
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = PARQUET_AVAILABLE
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError:
+                self.enabled = False
+    
+    @staticmethod
+    def file_key(data: bytes) -> str:
+        """Content hash identifying a workbook"""
+        return hashlib.sha256(data).hexdigest()
+    
+    def _manifest_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+    
+    def _sheet_path(self, key: str, sheet_name: str, columns: Optional[List] = None) -> str:
+        label = str(sheet_name) if columns is None else json.dumps([str(sheet_name), [str(col) for col in columns]])
+        sheet_hash = hashlib.sha256(label.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f"{key}-{sheet_hash}.parquet")
+    
+    def get_sniff(self, key: str) -> Optional[List[Dict]]:
+        """Return the cached header sniff of a workbook, or None"""
+        if not self.enabled:
+            return None
+        try:
+            with open(self._manifest_path(key), 'r', encoding='utf-8') as f:
+                sheets = json.load(f)['sheets']
+            return [{'name': sheet['name'], 'columns': list(sheet['columns']), 'rows': int(sheet['rows'])}
+                    for sheet in sheets]
+        except Exception:
+            return None
+    
+    def put_sniff(self, key: str, sheets: List[Dict]) -> None:
+        """Store the header sniff of a workbook"""
+        if not self.enabled:
+            return
+        try:
+            with open(self._manifest_path(key), 'w', encoding='utf-8') as f:
+                json.dump({'sheets': sheets}, f, default=str)
+        except (OSError, TypeError, ValueError):
+            pass
+    
+    def get_sheet(self, key: str, sheet_name: str, columns: Optional[List] = None) -> Optional[pd.DataFrame]:
+        """Return one cached sheet (optionally a column selection), or None on a miss"""
+        if not self.enabled:
+            return None
+        path = self._sheet_path(key, sheet_name, columns)
+        try:
+            df = pd.read_parquet(path)
+            now = time.time()
+            os.utime(path, (now, now))
+        except Exception:
+            self.misses += 1
+            return None
+        try:
+            os.utime(self._manifest_path(key), (now, now))
+        except OSError:
+            pass
+        self.hits += 1
+        return df
+    
+    def put_sheet(self, key: str, sheet_name: str, df: pd.DataFrame, columns: Optional[List] = None) -> bool:
+        """Store one parsed sheet; sheets Parquet cannot represent are skipped"""
+        if not self.enabled:
+            return False
+        path = self._sheet_path(key, sheet_name, columns)
+        try:
+            df.to_parquet(path)
+        except Exception:
+            # Mixed-type object columns or non-string headers: leave it uncached
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.skipped += 1
+            return False
+        self._evict()
+        return True
+    
+    def _entries(self) -> Dict[str, Dict]:
+        """Group cache files by workbook key with their size and last access"""
+        entries = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith(('.json', '.parquet')):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entry = entries.setdefault(name[:64], {'size': 0, 'accessed': 0.0, 'paths': []})
+            entry['size'] += stat.st_size
+            entry['accessed'] = max(entry['accessed'], stat.st_mtime)
+            entry['paths'].append(path)
+        return entries
+    
+    def _evict(self):
+        """Drop least-recently-used workbooks until the cache fits its cap"""
+        with self._lock:
+            entries = self._entries()
+            total = sum(entry['size'] for entry in entries.values())
+            for key in sorted(entries, key=lambda k: entries[k]['accessed']):
+                if total <= self.max_bytes:
+                    break
+                for path in entries[key]['paths']:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= entries[key]['size']
+    
+    def stats(self) -> Dict:
+        """Counters and disk usage for display"""
+        size = sum(entry['size'] for entry in self._entries().values()) if self.enabled else 0
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'skipped': self.skipped,
+            'size_mb': size / 1024 / 1024,
+            'max_mb': self.max_bytes / 1024 / 1024,
+        }
+
+# ============================================================================
+# PARALLEL INGESTION
+# ============================================================================
+
+# Uploads smaller than this in total are parsed serially: starting spawn workers takes longer than parsing them
+PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+
+def resolve_worker_count(max_workers: Optional[int], file_count: int) -> int:
+    """Turn a worker setting (0/None = one per CPU) into a pool size"""
+    if not max_workers or max_workers < 0:
+        max_workers = os.cpu_count() or 1
+    return max(1, min(max_workers, file_count))
+
+def _ingest_job(filename: str, data: bytes, plan: Optional[Dict] = None) -> Dict:
+    """Pool worker: parse one workbook, reporting failures instead of raising"""
+    try:
+        sheets, timing = timed_read_workbook(filename, data, plan)
+        return {'file': filename, 'sheets': sheets, 'timing': timing, 'error': None}
+    except Exception as e:
+        return {'file': filename, 'sheets': {}, 'timing': None, 'error': str(e)}
+
+def sniff_files(files: List[Tuple[str, bytes]], cache: Optional[IngestCache] = None) -> List[Optional[List[Dict]]]:
+    """Header-only pass over each workbook, in upload order.
+
+    Returns the ``sniff_workbook`` result per file, or None where the file
+    cannot be sniffed (legacy .xls, corrupt archives) and must be loaded in
+    full. Sniffs are cached with the workbook, so repeat uploads skip openpyxl.
+    """
+    sniffs = []
+    for filename, data in files:
+        key = cache.file_key(data) if cache is not None and cache.enabled else None
+        sheets = cache.get_sniff(key) if key else None
+        if sheets is None and is_xlsx(data):
+            try:
+                sheets = sniff_workbook(data)
+            except Exception:
+                sheets = None
+            else:
+                if key:
+                    cache.put_sniff(key, sheets)
+        sniffs.append(sheets)
+    return sniffs
+
+def ingest_files(files: List[Tuple[str, bytes]], max_workers: Optional[int] = None,
+                 cache: Optional[IngestCache] = None, plans: Optional[List[Optional[Dict]]] = None,
+                 parallel_min_bytes: int = PARALLEL_MIN_BYTES) -> List[Dict]:
+    """Parse several workbooks at once on a process pool.
+
+    openpyxl parsing is CPU-bound, so each workbook is handed to its own
+    worker process. Results come back in upload order as
+    ``{'file', 'sheets', 'timing', 'error'}`` dicts; a single file, a
+    one-worker setting or less than ``parallel_min_bytes`` left to parse
+    skips the pool entirely. ``plans`` optionally gives,
+    per file, the sheets to load and the columns to keep (see
+    ``read_workbook``). Sheets found in ``cache`` are loaded from Parquet and
+    only the rest reach the pool.
+    """
+    results = [None] * len(files)
+    keys = [None] * len(files)
+    plans = list(plans) if plans is not None else [None] * len(files)
+    cached_sheets = [{} for _ in files]
+    pending = []
+    
+    for position, (filename, data) in enumerate(files):
+        if cache is not None and cache.enabled:
+            started = time.perf_counter()
+            keys[position] = key = cache.file_key(data)
+            plan = plans[position]
+            if plan is None:
+                sniff = cache.get_sniff(key)
+                if sniff is not None:
+                    plan = plans[position] = {sheet['name']: None for sheet in sniff}
+            if plan is not None:
+                missing = {}
+                for sheet_name, columns in plan.items():
+                    df = cache.get_sheet(key, sheet_name, columns)
+                    if df is None:
+                        missing[sheet_name] = columns
+                    else:
+                        cached_sheets[position][sheet_name] = df
+                if not missing:
+                    sheets = cached_sheets[position]
+                    timing = {
+                        'file': filename,
+                        'sheets': len(sheets),
+                        'rows': sum(len(df) for df in sheets.values()),
+                        'seconds': round(time.perf_counter() - started, 3),
+                        'cached': True,
+                        'streamed': False,
+                    }
+                    results[position] = {'file': filename, 'sheets': sheets, 'timing': timing, 'error': None}
+                    continue
+                pending.append((position, missing))
+                continue
+        pending.append((position, plans[position]))
+    
+    jobs = [(files[position][0], files[position][1], plan) for position, plan in pending]
+    for (position, _), result in zip(pending, _parse_files(jobs, max_workers, parallel_min_bytes)):
+        if result['timing'] is not None:
+            key = keys[position]
+            plan = plans[position]
+            if key is not None:
+                for sheet_name, df in result['sheets'].items():
+                    cache.put_sheet(key, sheet_name, df, None if plan is None else plan[sheet_name])
+                if plan is None:
+                    # Nothing was known to look up, so every parsed sheet was a miss
+                    cache.misses += len(result['sheets'])
+                    cache.put_sniff(key, [
+                        {'name': sheet_name, 'columns': list(df.columns), 'rows': len(df)}
+                        for sheet_name, df in result['sheets'].items()
+                    ])
+            if plan is not None and cached_sheets[position]:
+                parsed = result['sheets']
+                result['sheets'] = {
+                    sheet_name: cached_sheets[position].get(sheet_name, parsed.get(sheet_name))
+                    for sheet_name in plan
+                    if sheet_name in cached_sheets[position] or sheet_name in parsed
+                }
+                result['timing']['sheets'] = len(result['sheets'])
+                result['timing']['rows'] = sum(len(df) for df in result['sheets'].values())
+            result['timing']['cached'] = False
+            result['timing']['streamed'] = False
+        results[position] = result
+    
+    return results
+
+def _parse_files(jobs: List[Tuple[str, bytes, Optional[Dict]]], max_workers: Optional[int],
+                 parallel_min_bytes: int = PARALLEL_MIN_BYTES) -> List[Dict]:
+    """Run the parse jobs, on a pool when there is more than one worker and enough data to repay starting it"""
+    workers = resolve_worker_count(max_workers, len(jobs))
+    if workers <= 1 or sum(len(data) for _, data, _ in jobs) < parallel_min_bytes:
+        return [_ingest_job(*job) for job in jobs]
+    
+    try:
+        # spawn rather than fork: the Streamlit server is multi-threaded
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            return list(pool.map(_ingest_job, *zip(*jobs)))
+    except (BrokenProcessPool, OSError):
+        return [_ingest_job(*job) for job in jobs]
@@ -0,0 +1,525 @@
+"""Processed feedback shared by the QTS Analytics dashboards: loading, appending, views and persistence."""
+
+import time
+import warnings
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from qts_aggregates import KPIAccumulator, accumulate_kpis, build_cube, combine_cubes
+from qts_ingest import (
+    FINGERPRINT_COLUMN, ROLE_KEYWORDS, IngestCache, add_fingerprints, append_unique_rows, assign_quarters,
+    categorical_candidates, coerce_scores, compact_frame, concat_frames, dataset_fingerprint, encode_categories,
+    ingest_files, is_xlsx, match_columns, memory_report, normalize_header, parse_dates, read_upload_bytes,
+    resolve_schema, sniff_files, stream_workbook
+)
+from qts_store import STORE_TABLES, FeedbackStore
+
+# ============================================================================
+# FEEDBACK PROCESSOR
+# ============================================================================
+
+class FeedbackProcessor:
+    """Delegate, partner and master feedback loaded from uploaded workbooks.
+
+    Holds the merged tables with their resolved schema, and keeps the
+    aggregation cube, KPI accumulators and feedback store in step as files
+    are appended. Each dashboard subclasses it to supply its sheet
+    segregator, rating column, metric keywords and date settings, and
+    overrides ``warn`` to show load problems in the page.
+    """
+    
+    # Class with identify_file_type, identify_sheet_type, select_master_columns and merge_similar_files
+    segregator = None
+    rating_column = None
+    metric_keywords: Dict = {}
+    date_formats: List = []
+    fiscal_year_start_month = 1
+    parallel_min_mb = 8.0
+    streaming_min_mb = 25.0
+    stream_chunk_rows = 50_000
+    
+    def __init__(self, max_workers: int = 0, cache: Optional[IngestCache] = None,
+                 schema_mapping: Optional[Dict] = None, store: Optional[FeedbackStore] = None):
+        self.delegate_data = None
+        self.partner_data = None
+        self.master_data = None
+        self.schema_mapping = schema_mapping or {}
+        self.max_workers = max_workers
+        self.cache = cache
+        self.store = store
+        self.parallel_min_bytes = int(self.parallel_min_mb * 1024 * 1024)
+        self.streaming_min_bytes = int(self.streaming_min_mb * 1024 * 1024)
+        self.ingest_timings = []
+        self.ingest_seconds = 0.0
+        self.memory_report = None
+        self.merge_report = []
+        self.merge_log = []
+        self.ingested_files = set()
+        self.version = 0
+        self._cube = None
+        self._cube_signature = None
+        self._kpis = None
+        self._kpi_signature = None
+        self._dataset_key = None
+        self._saved_dataset = None
+        self.refresh_schema()
+        
+    def process_files(self, uploaded_files: List) -> Tuple[bool, str]:
+        """Process multiple uploaded files with AI segregation"""
+        if not uploaded_files:
+            return False, "No files uploaded"
+        
+        try:
+            segregator = self.segregator()
+            
+            files = [(uploaded_file.name, read_upload_bytes(uploaded_file)) for uploaded_file in uploaded_files]
+            
+            categorized_files = self._load_files(files, segregator)
+            
+            self.merge_report = []
+            self.merge_log = []
+            merged_data = segregator.merge_similar_files(categorized_files, self.merge_report, self.merge_log)
+            
+            if 'delegate' in merged_data:
+                self.delegate_data = merged_data['delegate']
+            
+            if 'partner' in merged_data:
+                self.partner_data = merged_data['partner']
+            
+            if 'master' in merged_data:
+                self.master_data = merged_data['master']
+            elif self.delegate_data is not None:
+                self.master_data = self.delegate_data
+            
+            if self.delegate_data is None or len(self.delegate_data) == 0:
+                return False, "No valid delegate feedback data found"
+            
+            self.refresh_schema()
+            self.ingested_files = {IngestCache.file_key(data) for _, data in files}
+            self.version += 1
+            self.persist()
+            
+            return True, f"Successfully processed {len(uploaded_files)} file(s)"
+            
+        except Exception as e:
+            return False, f"Error processing files: {str(e)}"
+    
+    def _load_files(self, files: List[Tuple[str, bytes]], segregator) -> Dict[str, List[pd.DataFrame]]:
+        """Load every sheet of the given files and sort the frames by file type"""
+        categorized_files = {
+            'delegate': [],
+            'partner': [],
+            'master': []
+        }
+        
+        self.ingest_timings = []
+        started = time.perf_counter()
+        
+        # Classify every sheet from its header row before loading any data
+        plans = [
+            self._plan_sheets(filename, sniff, segregator)
+            for (filename, _), sniff in zip(files, sniff_files(files, self.cache))
+        ]
+        
+        # Very large workbooks are streamed; the rest are parsed in parallel once they are big enough
+        streamed = {position for position, (_, data) in enumerate(files) if self._should_stream(data)}
+        parsed = iter(ingest_files(
+            [file for position, file in enumerate(files) if position not in streamed],
+            self.max_workers,
+            self.cache,
+            [plans[position][1] for position in range(len(files)) if position not in streamed],
+            self.parallel_min_bytes
+        ))
+        
+        for position, (filename, data) in enumerate(files):
+            if position in streamed:
+                try:
+                    self._stream_file(filename, data, categorized_files, segregator, *plans[position])
+                except Exception as e:
+                    self.warn(f"Could not process {filename}: {str(e)}")
+                continue
+            
+            result = next(parsed)
+            if result['error']:
+                self.warn(f"Could not process {result['file']}: {result['error']}")
+                continue
+            
+            self.ingest_timings.append(result['timing'])
+            sheet_types = plans[position][0]
+            
+            for sheet_name, df in result['sheets'].items():
+                if df.empty:
+                    continue
+                
+                if sheet_types is not None and sheet_types.get(sheet_name) is not None:
+                    file_type = sheet_types[sheet_name]
+                else:
+                    file_type = segregator.identify_file_type(df, result['file'])
+                if file_type == 'delegate':
+                    df = self._process_delegate_data(df)
+                df.attrs['source'] = f"{result['file']} / {sheet_name}"
+                categorized_files[file_type].append(df)
+        
+        self.ingest_seconds = time.perf_counter() - started
+        
+        return categorized_files
+    
+    def append_files(self, uploaded_files: List) -> Tuple[bool, str]:
+        """Add newly uploaded files to the loaded data without reprocessing the files already in it"""
+        if self.delegate_data is None:
+            return self.process_files(uploaded_files)
+        
+        try:
+            files = []
+            keys = set()
+            for uploaded_file in uploaded_files:
+                data = read_upload_bytes(uploaded_file)
+                key = IngestCache.file_key(data)
+                if key not in self.ingested_files and key not in keys:
+                    files.append((uploaded_file.name, data))
+                    keys.add(key)
+            
+            if not files:
+                return False, "All of these files have already been processed"
+            
+            categorized_files = self._load_files(files, self.segregator())
+            added = self.append_frames(categorized_files, keys)
+            
+            return True, f"Appended {added:,} new delegate record(s) from {len(files)} file(s)"
+            
+        except Exception as e:
+            return False, f"Error appending files: {str(e)}"
+    
+    def append_frames(self, categorized_files: Dict[str, List[pd.DataFrame]], file_keys: Optional[set] = None) -> int:
+        """Fold processed frames into the loaded data, dropping rows it already holds.
+
+        Only the new rows are fingerprinted, date-parsed, aligned, coerced,
+        encoded and written to the feedback store; the existing rows are
+        matched on their stored fingerprints and keep their dtypes. The
+        memory report still describes the initial load. ``file_keys`` are
+        the content hashes of the files the frames came from. Returns the
+        number of delegate rows added.
+        """
+        master_follows = self.master_data is self.delegate_data
+        before = len(self.delegate_data) if self.delegate_data is not None else 0
+        known = set(self.delegate_data.columns) if self.delegate_data is not None else None
+        offsets = {}
+        cube_signature = self._cube_signature
+        kpi_signature = self._kpi_signature
+        self.merge_report = []
+        self.merge_log = []
+        
+        for file_type, dfs in categorized_files.items():
+            if not dfs:
+                continue
+            current = getattr(self, f"{file_type}_data")
+            if current is None or (file_type == 'master' and master_follows):
+                merged = self.segregator.merge_similar_files({file_type: dfs}, self.merge_report, self.merge_log)[file_type]
+            else:
+                offsets[file_type] = len(current)
+                if file_type == 'delegate':
+                    self._coerce_new_scores(dfs)
+                merged, duplicates, alignment = append_unique_rows(current, dfs)
+                if file_type != 'delegate':
+                    merged = merged.drop(columns=FINGERPRINT_COLUMN)
+                self.merge_log.extend({'type': file_type, **entry} for entry in alignment)
+                for position, (df, dropped) in enumerate(zip(dfs, duplicates)):
+                    self.merge_report.append({
+                        'type': file_type,
+                        'source': df.attrs.get('source', f"{file_type} {position + 1}"),
+                        'rows': len(df),
+                        'duplicates': dropped,
+                    })
+            setattr(self, f"{file_type}_data", merged)
+        
+        if master_follows and not categorized_files.get('master'):
+            self.master_data = self.delegate_data
+        
+        if 'delegate' in offsets:
+            self.refresh_schema([col for col in self.delegate_data.columns if col not in known])
+        else:
+            self.refresh_schema()
+        self.ingested_files |= set(file_keys or ())
+        self.version += 1
+        
+        columns = self._cube_columns()
+        if 'delegate' in offsets and cube_signature == (self.version - 1, columns):
+            # Fold the new rows into the existing cube instead of rebuilding it
+            self._cube = combine_cubes([self._cube, build_cube(self.delegate_data.iloc[offsets['delegate']:], **columns)])
+            self._cube_signature = (self.version, columns)
+        
+        columns = self._kpi_columns()
+        if 'delegate' in offsets and kpi_signature == (self.version - 1, columns):
+            # Only the new rows update the KPI accumulators
+            accumulate_kpis(self.delegate_data.iloc[offsets['delegate']:], **columns, accumulators=self._kpis)
+            self._kpi_signature = (self.version, columns)
+        
+        self.persist(offsets)
+        return len(self.delegate_data) - before
+    
+    def persist(self, offsets: Optional[Dict[str, int]] = None) -> bool:
+        """Write the loaded data to the feedback store.
+
+        ``offsets`` maps tables that only grew to their previous length, so
+        just the rows past it are written while the store still holds this
+        processor's last save; otherwise every row is written.
+        """
+        if self.store is None or not self.store.enabled:
+            return False
+        if offsets and self._saved_dataset is not None and self._save(offsets):
+            return True
+        return self._save({})
+    
+    def _save(self, offsets: Dict[str, int]) -> bool:
+        tables = {}
+        for table in STORE_TABLES:
+            df = getattr(self, f"{table}_data")
+            if table == 'master' and df is self.delegate_data:
+                tables[table] = 'delegate'
+            elif df is not None:
+                tables[table] = df.iloc[offsets[table]:] if table in offsets else df
+        state = {
+            'dataset': self.dataset_key(),
+            'version': self.version,
+            'ingested_files': sorted(self.ingested_files),
+            'kpis': {
+                'columns': self._kpi_columns(),
+                'quarters': {quarter: accumulator.to_dict() for quarter, accumulator in self.kpi_accumulators().items()},
+            },
+        }
+        saved = self.store.save(tables, state, appended=tuple(offsets), quarter_columns={'delegate': 'Quarter'},
+                                extends=self._saved_dataset)
+        if saved:
+            self._saved_dataset = state['dataset']
+        return saved
+    
+    def restore(self) -> bool:
+        """Load the data saved by an earlier session from the feedback store"""
+        loaded = self.store.load() if self.store is not None else None
+        if loaded is None:
+            return False
+        tables, state = loaded
+        if tables.get('delegate') is None or len(tables['delegate']) == 0:
+            return False
+        
+        self.delegate_data = tables['delegate']
+        self.partner_data = tables.get('partner')
+        self.master_data = tables.get('master')
+        if self.master_data is None:
+            self.master_data = self.delegate_data
+        self.ingested_files = set(state.get('ingested_files', []))
+        self.version = int(state.get('version', 0))
+        self._saved_dataset = state.get('dataset')
+        self.refresh_schema()
+        
+        kpis = state.get('kpis', {})
+        if kpis.get('columns') == self._kpi_columns():
+            self._kpis = {quarter: KPIAccumulator.from_dict(entry) for quarter, entry in kpis['quarters'].items()}
+            self._kpi_signature = (self.version, self._kpi_columns())
+        return True
+    
+    def _cube_columns(self) -> Dict:
+        metric_groups = [key for key in ('metrics', 'radar_metrics') if key in self.schema]
+        return {
+            'trainer_col': self.schema['trainer'],
+            'course_col': self.schema['course'],
+            'rating_col': self.schema['rating'],
+            'metric_columns': [col for key in metric_groups for col in self.schema[key].values()],
+        }
+    
+    def aggregate_cube(self) -> pd.DataFrame:
+        """Trainer × course × quarter aggregates of the delegate data, built once per dataset version"""
+        columns = self._cube_columns()
+        if self._cube is None or self._cube_signature != (self.version, columns):
+            self._cube = build_cube(self.delegate_data, **columns)
+            self._cube_signature = (self.version, columns)
+        return self._cube
+    
+    def _kpi_columns(self) -> Dict:
+        return {'trainer_col': self.schema['trainer'], 'course_col': self.schema['course'], 'rating_col': self.schema['rating']}
+    
+    def kpi_accumulators(self) -> Dict[str, KPIAccumulator]:
+        """Per-quarter KPI accumulators of the delegate data, built once per dataset version"""
+        columns = self._kpi_columns()
+        if self._kpis is None or self._kpi_signature != (self.version, columns):
+            self._kpis = accumulate_kpis(self.delegate_data, **columns)
+            self._kpi_signature = (self.version, columns)
+        return self._kpis
+    
+    def dataset_key(self) -> str:
+        """Content fingerprint of the delegate data and its schema, computed once per dataset version"""
+        if self._dataset_key is None or self._dataset_key[0] != self.version:
+            key = dataset_fingerprint(self.delegate_data, self.schema, self.fiscal_year_start_month)
+            self._dataset_key = (self.version, key)
+        return self._dataset_key[1]
+    
+    def load_view(self, quarter_range: Optional[Tuple[pd.Period, pd.Period]] = None) -> Tuple[pd.DataFrame, Dict]:
+        """Delegate rows within an inclusive quarter range, and how many quarters and rows it selected.
+
+        The rows are filtered in memory: the loaded data already holds every
+        row, so reading the feedback store's quarter partitions again would
+        only duplicate it. No range means every row.
+        """
+        df = self.delegate_data
+        quarters = df['Quarter'] if 'Quarter' in df.columns else None
+        if quarter_range is not None and quarters is not None:
+            view = df[(quarters >= quarter_range[0]) & (quarters <= quarter_range[1])]
+        else:
+            view = df
+        scan = {
+            'quarters': view['Quarter'].nunique(dropna=False) if quarters is not None else 1,
+            'total_quarters': quarters.nunique(dropna=False) if quarters is not None else 1,
+            'rows': len(view),
+            'total_rows': len(df),
+        }
+        return view, scan
+    
+    def warn(self, message: str) -> None:
+        """Report a file that could not be loaded"""
+        warnings.warn(message)
+    
+    def _resolve_schema(self, columns: List) -> Dict:
+        """Column roles of the delegate headers; subclasses add their own roles"""
+        return resolve_schema(columns, self.rating_column, self.metric_keywords, self.schema_mapping)
+    
+    def refresh_schema(self, columns: Optional[List] = None) -> Dict:
+        """Resolve which delegate columns hold the trainer, course, rating, date, comments and sub-metrics.
+
+        ``columns`` limits score coercion and categorical encoding to the
+        delegate columns an append added; the others already went through
+        them, and the memory report is left as it was.
+        """
+        self.schema = self._resolve_schema(list(self.delegate_data.columns) if self.delegate_data is not None else [])
+        if self.delegate_data is None:
+            return self.schema
+        if columns is None:
+            before = self.delegate_data.memory_usage(deep=True, index=False)
+            self._coerce_score_columns()
+            encode_categories(self.delegate_data, [self.schema['trainer'], self.schema['course']])
+            self.memory_report = memory_report(before, self.delegate_data)
+        else:
+            self._coerce_score_columns(columns)
+            encode_categories(self.delegate_data, [self.schema['trainer'], self.schema['course']], subset=columns)
+        return self.schema
+    
+    def _score_columns(self) -> List:
+        """The rating column followed by the sub-metric columns of the schema"""
+        metric_groups = [key for key in ('metrics', 'radar_metrics') if key in self.schema]
+        columns = [self.schema['rating']] + [col for key in metric_groups for col in self.schema[key].values()]
+        return [col for col in dict.fromkeys(columns) if col is not None]
+    
+    def _coerce_new_scores(self, frames: List[pd.DataFrame]) -> None:
+        """Make the score columns of appended frames numeric, matching the loaded ones"""
+        scores = {normalize_header(col) for col in self._score_columns()}
+        for df in frames:
+            coerce_scores(df, [col for col in df.columns if normalize_header(col) in scores], min_numeric_share=0.0)
+    
+    def _coerce_score_columns(self, only: Optional[List] = None) -> None:
+        """Make the rating and sub-metric columns numeric once, so views never re-parse them.
+
+        With ``only``, other columns are taken as already coerced and judged by their dtype.
+        """
+        rating = self.schema['rating']
+        if rating and (only is None or rating in only or not pd.api.types.is_numeric_dtype(self.delegate_data[rating])):
+            coerce_scores(self.delegate_data, [rating], min_numeric_share=0.0)
+        
+        metric_groups = [key for key in ('metrics', 'radar_metrics') if key in self.schema]
+        candidates = [col for key in metric_groups for col in self.schema[key].values()]
+        if only is None:
+            numeric = set(coerce_scores(self.delegate_data, candidates))
+        else:
+            numeric = set(coerce_scores(self.delegate_data, [col for col in candidates if col in only]))
+            numeric |= {col for col in candidates if col not in only and pd.api.types.is_numeric_dtype(self.delegate_data[col])}
+        # A text column matching a metric keyword (e.g. "Any other feedback") is not a score
+        for key in metric_groups:
+            self.schema[key] = {name: col for name, col in self.schema[key].items() if col in numeric}
+    
+    def _should_stream(self, data: bytes) -> bool:
+        """Stream workbooks too large to materialise through openpyxl's full model"""
+        return is_xlsx(data) and len(data) >= self.streaming_min_bytes
+    
+    def _plan_sheets(self, filename: str, sniff: Optional[List[Dict]], segregator) -> Tuple[Optional[Dict], Optional[Dict]]:
+        """Classify sniffed sheets and decide which sheets and columns to load.
+
+        Returns ``(sheet_types, plan)``; both are None when the workbook could
+        not be sniffed and has to be loaded in full. Header-only sheets are
+        skipped, and master sheets only load the columns the dashboard reads.
+        A sheet whose type only its row count decides is typed None: the
+        sniffed count comes from the sheet dimensions, which include
+        formatted blank rows, so it is loaded in full and classified once
+        its real rows are known.
+        """
+        if sniff is None:
+            return None, None
+        
+        sheet_types = {}
+        plan = {}
+        for sheet in sniff:
+            if not sheet['columns'] or sheet['rows'] == 0:
+                continue
+            file_type = segregator.identify_sheet_type(sheet['columns'], sheet['rows'], filename)
+            if file_type != segregator.identify_sheet_type(sheet['columns'], 0, filename):
+                file_type = None
+            columns = None
+            if file_type == 'master':
+                columns = segregator.select_master_columns(sheet['columns'])
+                if not columns:
+                    continue
+            sheet_types[sheet['name']] = file_type
+            plan[sheet['name']] = columns
+        return sheet_types, plan
+    
+    def _stream_file(self, filename: str, data: bytes, categorized_files: Dict, segregator,
+                     sheet_types: Optional[Dict] = None, plan: Optional[Dict] = None) -> None:
+        """Ingest a large workbook chunk by chunk, compacting each chunk as it arrives"""
+        started = time.perf_counter()
+        sheet_count = 0
+        row_count = 0
+        
+        for sheet_name, chunks in stream_workbook(data, self.stream_chunk_rows):
+            if plan is not None and sheet_name not in plan:
+                continue
+            sheet_count += 1
+            file_type = sheet_types.get(sheet_name) if sheet_types is not None else None
+            columns = plan[sheet_name] if plan is not None else None
+            categorical_columns = None
+            parts = []
+            
+            for chunk in chunks:
+                if columns is not None:
+                    chunk = chunk[columns]
+                if file_type is None:
+                    file_type = segregator.identify_file_type(chunk, filename)
+                if file_type == 'delegate':
+                    chunk = self._process_delegate_data(chunk)
+                if categorical_columns is None:
+                    categorical_columns = categorical_candidates(chunk)
+                row_count += len(chunk)
+                parts.append(compact_frame(chunk, categorical_columns))
+            
+            if parts:
+                df = concat_frames(parts)
+                df.attrs['source'] = f"{filename} / {sheet_name}"
+                categorized_files[file_type].append(df)
+        
+        self.ingest_timings.append({
+            'file': filename,
+            'sheets': sheet_count,
+            'rows': row_count,
+            'seconds': round(time.perf_counter() - started, 3),
+            'cached': False,
+            'streamed': True,
+        })
+    
+    def _process_delegate_data(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Process delegate data with date parsing and quarter assignment"""
+        df = add_fingerprints(df.copy())
+        
+        date_col = match_columns(df.columns, {'date': ROLE_KEYWORDS['date']}, self.schema_mapping)['date']
+        
+        if date_col:
+            df['Parsed_Date'] = parse_dates(df[date_col], self.date_formats)
+            df['Quarter'] = assign_quarters(df['Parsed_Date'], self.fiscal_year_start_month)
+        
+        return df
@@ -0,0 +1,242 @@
+"""Persistent columnar store of processed feedback for the QTS Analytics dashboards."""
+
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from qts_ingest import PARQUET_AVAILABLE, align_frames, concat_frames
+
+STORE_TABLES = ('delegate', 'partner', 'master')
+STORE_FORMAT = 1
+
+# ============================================================================
+# STORAGE HELPERS
+# ============================================================================
+
+def _storable(df: pd.DataFrame) -> pd.DataFrame:
+    """Make a frame writable as Parquet: string headers, no mixed-type object columns.
+
+    Mixed columns (typically raw date cells holding both datetimes and
+    text) are stored as text; everything the dashboard computes on has a
+    proper dtype already.
+    """
+    df = df.rename(columns={col: str(col) for col in df.columns if not isinstance(col, str)})
+    mixed = {}
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) not in ('string', 'empty', 'boolean', 'bytes'):
+            mixed[col] = df[col].map(lambda value: value if pd.isna(value) else str(value)).astype('str')
+    return df.assign(**mixed) if mixed else df
+
+def _in_range(part: Dict, quarters: Optional[Tuple[str, str]]) -> bool:
+    """Whether a part can hold rows in an inclusive quarter range"""
+    if quarters is None or 'quarter' not in part:
+        return True
+    # 'YYYYQn' labels of one frequency sort chronologically as strings
+    return part['quarter'] is not None and quarters[0] <= part['quarter'] <= quarters[1]
+
+# ============================================================================
+# FEEDBACK STORE
+# ============================================================================
+
+class FeedbackStore:
+    """Processed delegate, partner and master data kept on disk between sessions.
+
+    Each table is a list of Parquet parts named in ``manifest.json``. A full
+    save replaces a table's parts; an append adds parts holding only the new
+    rows, so growing a large history does not rewrite it. Tables saved with
+    a quarter column get one part per quarter, and ``scan`` reads only the
+    parts inside a quarter range. The manifest is swapped atomically and
+    files it no longer names are removed, so readers never see a
+    half-written snapshot.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.enabled = PARQUET_AVAILABLE and bool(directory)
+        self._lock = threading.Lock()
+        if self.enabled:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError:
+                self.enabled = False
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, 'manifest.json')
+
+    def _read_manifest(self) -> Optional[Dict]:
+        try:
+            with open(self._manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return manifest if manifest.get('format') == STORE_FORMAT else None
+
+    def _write_manifest(self, manifest: Dict) -> None:
+        temporary = f"{self._manifest_path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, default=str)
+        os.replace(temporary, self._manifest_path)
+
+    def _write_part(self, table: str, df: pd.DataFrame) -> Dict:
+        name = f"{table}-{uuid.uuid4().hex[:12]}.parquet"
+        _storable(df).to_parquet(os.path.join(self.directory, name), index=False)
+        return {'file': name, 'rows': len(df)}
+
+    def _write_parts(self, table: str, df: pd.DataFrame, quarter_column: Optional[str] = None) -> List[Dict]:
+        """Write a frame as one part, or one part per quarter (rows without a quarter together)"""
+        if quarter_column is None or quarter_column not in df.columns or df.empty:
+            return [self._write_part(table, df)]
+        parts = []
+        groups = df.groupby(quarter_column, dropna=False, observed=True, sort=False).indices
+        for quarter, positions in groups.items():
+            part = self._write_part(table, df.iloc[positions])
+            part['quarter'] = None if pd.isna(quarter) else str(quarter)
+            parts.append(part)
+        return parts
+
+    def _collect_garbage(self, manifest: Dict) -> None:
+        """Remove part files the manifest no longer refers to"""
+        live = {part['file'] for table in manifest['tables'].values() for part in table.get('parts', [])}
+        for name in os.listdir(self.directory):
+            if name.endswith(('.parquet', '.tmp')) and name not in live:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def save(self, tables: Dict[str, Union[pd.DataFrame, str]], state: Dict, appended: Tuple = (),
+             quarter_columns: Optional[Dict[str, str]] = None, extends: Optional[str] = None) -> bool:
+        """Write processed tables and the processor state to the store.
+
+        A table given as a string is stored as an alias of that table (master
+        falling back to delegate). Tables named in ``appended`` hold only the
+        rows added since the last save and become extra parts; the others
+        replace what is stored. Stored tables missing from ``tables`` are
+        kept. ``quarter_columns`` names the Period column to partition each
+        table by. Appending requires the stored state's ``dataset`` id to be
+        ``extends``; when another session has saved since, nothing is
+        written and False is returned.
+        """
+        quarter_columns = quarter_columns or {}
+        if not self.enabled:
+            return False
+        with self._lock:
+            manifest = self._read_manifest() or {'format': STORE_FORMAT, 'tables': {}}
+            if appended and manifest.get('state', {}).get('dataset') != extends:
+                return False
+            try:
+                for table, df in tables.items():
+                    if isinstance(df, str):
+                        manifest['tables'][table] = {'alias': df}
+                        continue
+                    stored = manifest['tables'].get(table, {})
+                    parts = list(stored.get('parts', [])) if table in appended else []
+                    if len(df) or not parts:
+                        parts.extend(self._write_parts(table, df, quarter_columns.get(table)))
+                    manifest['tables'][table] = {'parts': parts, 'rows': sum(part['rows'] for part in parts)}
+                manifest['state'] = state
+                manifest['saved_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+                self._write_manifest(manifest)
+            except Exception:
+                return False
+            finally:
+                # Parts of a failed save are not in the manifest and are removed here
+                self._collect_garbage(self._read_manifest() or {'tables': {}})
+        return True
+
+    def _read_parts(self, parts: List[Dict]) -> Optional[pd.DataFrame]:
+        frames = [pd.read_parquet(os.path.join(self.directory, part['file'])) for part in parts]
+        if not frames:
+            return None
+        if len(frames) == 1:
+            return frames[0]
+        # Parts appended later may have gained columns or wider dtypes
+        aligned, _ = align_frames(frames)
+        return concat_frames(aligned)
+
+    def load(self) -> Optional[Tuple[Dict[str, Optional[pd.DataFrame]], Dict]]:
+        """Return ``(tables, state)`` as last saved, or None when the store is empty or unreadable"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            manifest = self._read_manifest()
+            if manifest is None:
+                return None
+            try:
+                tables = {table: self._read_parts(entry['parts']) for table, entry in manifest['tables'].items()
+                          if 'alias' not in entry}
+            except Exception:
+                return None
+        for table, entry in manifest['tables'].items():
+            if 'alias' in entry:
+                tables[table] = tables.get(entry['alias'])
+        return tables, manifest.get('state', {})
+
+    def scan(self, table: str, quarters: Optional[Tuple[str, str]] = None,
+             dataset: Optional[str] = None) -> Tuple[Optional[pd.DataFrame], Dict]:
+        """Read the rows of a table in an inclusive ``('2024Q1', '2024Q4')`` quarter range.
+
+        Only parts whose quarter falls inside the range are opened. Returns
+        the rows (None when no part matches or the store cannot be read) and
+        how many partitions and rows were scanned out of the table's total.
+        With ``dataset``, nothing is read unless the stored state's
+        ``dataset`` id matches, so a session never scans data another
+        session saved; the totals are then zero.
+        """
+        stats = {'source': 'store', 'partitions': 0, 'total_partitions': 0, 'rows': 0, 'total_rows': 0}
+        if not self.enabled:
+            return None, stats
+        with self._lock:
+            manifest = self._read_manifest()
+            if manifest is not None and dataset is not None and manifest.get('state', {}).get('dataset') != dataset:
+                manifest = None
+            entry = manifest['tables'].get(table) if manifest is not None else None
+            if entry is not None and 'alias' in entry:
+                entry = manifest['tables'].get(entry['alias'])
+            if entry is None:
+                return None, stats
+            selected = [part for part in entry['parts'] if _in_range(part, quarters)]
+            stats.update({
+                'partitions': len(selected),
+                'total_partitions': len(entry['parts']),
+                'rows': sum(part['rows'] for part in selected),
+                'total_rows': entry['rows'],
+            })
+            try:
+                return self._read_parts(selected), stats
+            except Exception:
+                return None, stats
+
+    def info(self) -> Dict:
+        """Summary of what is stored, for display"""
+        manifest = self._read_manifest() if self.enabled else None
+        if manifest is None:
+            return {'enabled': self.enabled, 'saved_at': None, 'tables': {}, 'size_mb': 0.0}
+        size = 0
+        for name in os.listdir(self.directory):
+            try:
+                size += os.path.getsize(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        tables = {
+            table: {'alias': entry['alias']} if 'alias' in entry else {'rows': entry['rows'], 'parts': len(entry['parts'])}
+            for table, entry in manifest['tables'].items()
+        }
+        return {'enabled': True, 'saved_at': manifest.get('saved_at'), 'tables': tables, 'size_mb': size / 1024 / 1024}
+
+    def clear(self) -> None:
+        """Delete everything stored"""
+        if not self.enabled:
+            return
+        with self._lock:
+            try:
+                os.remove(self._manifest_path)
+            except OSError:
+                pass
+            self._collect_garbage({'tables': {}})
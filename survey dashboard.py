@@ -6,10 +6,17 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datetime import datetime, timedelta
 import warnings
+import functools
 import io
 import requests
 import json
+import os
+import time
 from typing import Dict, List, Optional
+
+from qts_ingest import IngestCache, coerce_scores, encode_categories, ingest_files, read_upload_bytes
+from qts_aggregates import group_slices
+from qts_ai import HealthCheck, ResponseCache, http_session, ollama_available, read_ollama_stream, request_concurrency, stream_concurrently, timing_summary
 warnings.filterwarnings('ignore')
 
 # ============================================================================
@@ -43,11 +50,39 @@ PERFORMANCE_LEVELS = {
     0.0: ('Needs Improvement', '📈', '#ef4444')
 }
 
+# Trainer profile sub-metrics, matched by keyword in the delegate headers
+METRIC_KEYS = ['knowledge', 'adaptability', 'feedback', 'guidance']
+
 DATE_FORMATS = [
     '%d/%m/%Y', '%Y-%m-%d', '%m/%d/%Y', '%d-%m-%Y', 
     '%Y/%m/%d', '%d/%m/%y', '%y-%m-%d', '%m/%d/%y'
 ]
 
+# On-disk Parquet cache of parsed workbooks, keyed by file content
+INGEST_CACHE_DIR = os.getenv('QTS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'qts_analytics', 'ingest'))
+INGEST_CACHE_MB = int(os.getenv('QTS_INGEST_CACHE_MB', '512'))
+
+# Successful LLM responses are reused from here; set QTS_LLM_CACHE to an empty string to disable
+LLM_CACHE_PATH = os.getenv('QTS_LLM_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'qts_analytics', 'llm_responses.sqlite'))
+LLM_CACHE_TTL_HOURS = float(os.getenv('QTS_LLM_CACHE_TTL_HOURS', '168'))
+LLM_CACHE_MB = int(os.getenv('QTS_LLM_CACHE_MB', '64'))
+
+# Trainer insights requested at once, capped by OLLAMA_NUM_PARALLEL when it is set for this process
+AI_CONCURRENCY = int(os.getenv('QTS_AI_CONCURRENCY', '4'))
+
+# Stream insight tokens into their cards as they arrive (0 waits for whole answers)
+AI_STREAMING = os.getenv('QTS_AI_STREAM', '1') != '0'
+
+# Ollama HTTP client: keep-alive pool size, seconds allowed to connect and between bytes of a response
+OLLAMA_POOL_SIZE = int(os.getenv('QTS_OLLAMA_POOL_SIZE', str(max(AI_CONCURRENCY, 1))))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv('QTS_OLLAMA_CONNECT_TIMEOUT', '3'))
+OLLAMA_READ_TIMEOUT = float(os.getenv('QTS_OLLAMA_READ_TIMEOUT', '30'))
+
+# Ollama server, and how long a liveness probe result is trusted before it is refreshed in the background
+OLLAMA_URL = os.getenv('QTS_OLLAMA_URL', 'http://localhost:11434')
+OLLAMA_MODEL = os.getenv('QTS_OLLAMA_MODEL', 'llama3.2')
+PROVIDER_HEALTH_TTL = float(os.getenv('QTS_PROVIDER_HEALTH_TTL', '30'))
+
 # ============================================================================
 # PAGE SETUP - PREMIUM EXPERIENCE
 # ============================================================================
@@ -353,6 +388,62 @@ def get_performance_level(rating):
     else:
         return 'Very Good'
 
+def render_executive_summary(slot, summary):
+    """Draw the AI executive summary card into a placeholder"""
+    slot.markdown(f"""
+        <div class="insight-container" style="border-left-color: {BRAND_COLOR};">
+            <div class="insight-content">
+                {summary}
+            </div>
+        </div>
+    """, unsafe_allow_html=True)
+
+def latency_caption(timings):
+    """One line on how quickly Ollama answered, or None when nothing was requested"""
+    summary = timing_summary(timings)
+    if not summary['requests']:
+        return None
+    if summary['total'] is None:
+        return f"⚡ {summary['requests']} AI response(s) served from cache"
+    first_token = f"first token after {summary['first_token']:.2f}s, " if summary['first_token'] is not None else ""
+    headers = f"headers after {summary['headers']:.2f}s, " if summary['headers'] is not None else ""
+    return (f"⚡ {summary['requests']} AI response(s), {summary['cached']} from cache; "
+            f"median {headers}{first_token}complete after {summary['total']:.2f}s")
+
+def render_trainer_profile(slot, color, summary):
+    """Draw a trainer's AI profile card into a placeholder"""
+    slot.markdown(f"""
+        <div class="insight-container" style="border-left-color: {color};">
+            <div class="insight-title" style="color: {color};">
+                ✨ Trainer Profile
+            </div>
+            <div class="insight-content">
+                {summary}
+            </div>
+        </div>
+    """, unsafe_allow_html=True)
+
+@st.cache_resource
+def get_ingest_cache():
+    """Process-wide ingest cache shared by every session"""
+    return IngestCache(INGEST_CACHE_DIR, INGEST_CACHE_MB * 1024 * 1024)
+
+@st.cache_resource
+def get_response_cache():
+    """Process-wide LLM response cache shared by every session"""
+    return ResponseCache(LLM_CACHE_PATH, LLM_CACHE_TTL_HOURS * 3600, LLM_CACHE_MB * 1024 * 1024)
+
+@st.cache_resource
+def get_http_session():
+    """Process-wide pooled HTTP session for Ollama, shared by every engine and session"""
+    return http_session(OLLAMA_POOL_SIZE)
+
+@st.cache_resource
+def get_ollama_health():
+    """Process-wide Ollama availability, re-probed in the background once it is PROVIDER_HEALTH_TTL seconds old"""
+    probe = functools.partial(ollama_available, get_http_session(), OLLAMA_URL, OLLAMA_MODEL, timeout=(OLLAMA_CONNECT_TIMEOUT, 2))
+    return HealthCheck(probe, PROVIDER_HEALTH_TTL)
+
 # ============================================================================
 # AI INTEGRATION (OLLAMA)
 # ============================================================================
@@ -360,50 +451,82 @@ def get_performance_level(rating):
 class AIInsightsEngine:
     """Ollama-powered insights engine (runs locally, completely free!)"""
     
-    def __init__(self, model: str = "llama3.2", ollama_url: str = "http://localhost:11434"):
+    def __init__(self, model: str = OLLAMA_MODEL, ollama_url: str = OLLAMA_URL,
+                 cache: Optional[ResponseCache] = None, stream: bool = AI_STREAMING,
+                 session: Optional[requests.Session] = None, health: Optional[HealthCheck] = None):
         self.model = model
         self.ollama_url = ollama_url
-        self.available = self._check_ollama_available()
+        self.http = session if session is not None else requests
+        self.cache = cache
+        self.stream = stream
+        self.timings = []
+        self.health = health
+        self.available = health.available() if health is not None else self._check_ollama_available()
     
     def _check_ollama_available(self) -> bool:
         """Check if Ollama is running and accessible"""
         try:
-            response = requests.get(f"{self.ollama_url}/api/tags", timeout=2)
-            if response.status_code == 200:
-                models = response.json().get('models', [])
-                model_names = [m.get('name', '').split(':')[0] for m in models]
-                return any(self.model in name for name in model_names)
-            return False
+            return ollama_available(self.http, self.ollama_url, self.model, timeout=(OLLAMA_CONNECT_TIMEOUT, 2))
         except:
             return False
     
-    def _call_ollama(self, prompt: str, system_prompt: str, max_tokens: int = 200) -> str:
-        """Make a call to Ollama API"""
+    def _call_ollama(self, prompt: str, system_prompt: str, max_tokens: int = 200, on_token=None) -> str:
+        """Make a call to Ollama API, reusing the cached response to an identical request"""
+        options = {
+            "num_predict": max_tokens,
+            "temperature": 0.7
+        }
+        key = ResponseCache.key('ollama', self.model, [system_prompt, prompt], options)
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            self.timings.append({'cached': True, 'first_token': None, 'total': 0.0})
+            return cached
+        
+        streaming = self.stream and on_token is not None
+        started = time.time()
         try:
-            response = requests.post(
+            response = self.http.post(
                 f"{self.ollama_url}/api/generate",
                 json={
                     "model": self.model,
                     "prompt": prompt,
                     "system": system_prompt,
-                    "stream": False,
-                    "options": {
-                        "num_predict": max_tokens,
-                        "temperature": 0.7
-                    }
+                    "stream": streaming,
+                    "options": options
                 },
-                timeout=30
+                timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT),
+                stream=streaming
             )
             
-            if response.status_code == 200:
-                return response.json().get('response', '').strip()
-            else:
-                return None
+            with response:
+                if response.status_code != 200:
+                    if self.health is not None:
+                        self.health.invalidate(f"HTTP {response.status_code}")
+                    return None
+                if streaming:
+                    result, first_token = read_ollama_stream(response, on_token, started)
+                    result = result.strip()
+                else:
+                    result = response.json().get('response', '').strip()
+                    first_token = time.time() - started
         except Exception as e:
+            if self.health is not None:
+                self.health.invalidate(str(e))
             return None
-    
-    def generate_personalized_trainer_summary(self, trainer_name: str, metrics: Dict, comments: List[str]) -> str:
-        """Generate detailed personalized trainer summary"""
+        self.timings.append({
+            'cached': False,
+            'headers': response.elapsed.total_seconds(),
+            'first_token': first_token,
+            'total': time.time() - started,
+        })
+        
+        if self.cache is not None:
+            self.cache.put(key, 'ollama', self.model, result)
+        return result
+    
+    def generate_personalized_trainer_summary(self, trainer_name: str, metrics: Dict, comments: List[str],
+                                              on_token=None) -> str:
+        """Generate detailed personalized trainer summary, streaming the text so far to ``on_token``"""
         if not self.available or not comments:
             return self._fallback_trainer_summary(trainer_name, metrics, comments)
         
@@ -430,7 +553,7 @@ Be specific, warm, and actionable."""
 
         system_prompt = "You are a training evaluation expert. Write personalized, specific profiles that celebrate achievements. Be warm but professional."
         
-        result = self._call_ollama(prompt, system_prompt, max_tokens=250)
+        result = self._call_ollama(prompt, system_prompt, max_tokens=250, on_token=on_token)
         
         if result:
             return result
@@ -464,8 +587,8 @@ Be specific, warm, and actionable."""
         
         return summary
     
-    def generate_summary_insight(self, kpis: Dict, data: pd.DataFrame) -> str:
-        """Generate executive summary"""
+    def generate_summary_insight(self, kpis: Dict, data: pd.DataFrame, on_token=None) -> str:
+        """Generate executive summary, streaming the text so far to ``on_token``"""
         if not self.available:
             return self._fallback_summary(kpis, data)
         
@@ -482,7 +605,7 @@ Focus on the most important insight and one actionable recommendation."""
 
         system_prompt = "You are a data analyst specializing in training program evaluation. Be concise and actionable."
         
-        result = self._call_ollama(prompt, system_prompt, max_tokens=150)
+        result = self._call_ollama(prompt, system_prompt, max_tokens=150, on_token=on_token)
         
         if result:
             return result
@@ -511,10 +634,12 @@ Focus on the most important insight and one actionable recommendation."""
 class QTSDataProcessor:
     """Enhanced data processor with better error handling"""
     
-    def __init__(self):
+    def __init__(self, cache: Optional[IngestCache] = None):
         self.delegate_data = None
         self.partner_data = None
         self.master_data = None
+        self.metric_columns = {}
+        self.cache = cache
         self.processing_log = []
     
     def safe_date_parse(self, data, date_column):
@@ -537,19 +662,22 @@ class QTSDataProcessor:
     def load_excel_smart(self, file):
         """Load Excel with multi-sheet support"""
         try:
-            excel_data = pd.read_excel(file, sheet_name=None)
+            result = ingest_files([(file.name, read_upload_bytes(file))], cache=self.cache)[0]
+            if result['error']:
+                raise ValueError(result['error'])
             
-            if isinstance(excel_data, dict):
-                dfs = []
-                for sheet_name, df in excel_data.items():
-                    if not df.empty:
-                        df['Source_Sheet'] = sheet_name
-                        dfs.append(df)
-                if dfs:
-                    self.processing_log.append(f"✓ Combined {len(dfs)} sheets")
-                    return pd.concat(dfs, ignore_index=True)
-            else:
-                return list(excel_data.values())[0]
+            excel_data, timing = result['sheets'], result['timing']
+            source = "cache" if timing['cached'] else "workbook"
+            self.processing_log.append(f"✓ Read {timing['sheets']} sheet(s) from {timing['file']} ({source}) in {timing['seconds']:.2f}s")
+            
+            dfs = []
+            for sheet_name, df in excel_data.items():
+                if not df.empty:
+                    df['Source_Sheet'] = sheet_name
+                    dfs.append(df)
+            if dfs:
+                self.processing_log.append(f"✓ Combined {len(dfs)} sheets")
+                return pd.concat(dfs, ignore_index=True)
         except Exception as e:
             st.error(f"Error loading Excel: {e}")
             self.processing_log.append(f"✗ Error: {str(e)}")
@@ -558,13 +686,20 @@ class QTSDataProcessor:
     def clean_numeric_columns(self, data):
         """Clean and standardize numeric rating columns"""
         rating_columns = [col for col in data.columns if 'rating' in col.lower() or 'score' in col.lower()]
-        
-        for col in rating_columns:
-            if col in data.columns:
-                data[col] = pd.to_numeric(data[col], errors='coerce')
-        
+        coerce_scores(data, rating_columns, min_numeric_share=0.0)
         return data
     
+    def find_metric_columns(self, data):
+        """Resolve the trainer sub-metric columns and convert them to numbers once"""
+        metric_cols = {}
+        for metric_key in METRIC_KEYS:
+            cols = [col for col in data.columns if metric_key in col.lower()]
+            if cols:
+                metric_cols[metric_key] = cols[0]
+        # A text column matching a keyword (e.g. "Any other feedback") is not a score
+        numeric = set(coerce_scores(data, list(metric_cols.values())))
+        return {key: col for key, col in metric_cols.items() if col in numeric}
+    
     def load_data(self, delegate_file=None, partner_file=None, master_file=None):
         """Load data from uploaded files with enhanced processing"""
         self.processing_log = []
@@ -576,6 +711,8 @@ class QTSDataProcessor:
                 self.delegate_data.columns = self.delegate_data.columns.str.strip()
                 self.delegate_data = self.safe_date_parse(self.delegate_data, 'Date of Course')
                 self.delegate_data = self.clean_numeric_columns(self.delegate_data)
+                self.metric_columns = self.find_metric_columns(self.delegate_data)
+                encode_categories(self.delegate_data, ['Tutor Name'])
                 st.success(f"✅ Delegate feedback: {len(self.delegate_data):,} records")
                 success = True
         
@@ -584,6 +721,7 @@ class QTSDataProcessor:
             if self.partner_data is not None:
                 self.partner_data.columns = self.partner_data.columns.str.strip()
                 self.partner_data = self.clean_numeric_columns(self.partner_data)
+                encode_categories(self.partner_data)
                 st.success(f"✅ Partner feedback: {len(self.partner_data):,} records")
                 success = True
         
@@ -593,6 +731,7 @@ class QTSDataProcessor:
                 self.master_data.columns = self.master_data.columns.str.strip()
                 self.master_data = self.safe_date_parse(self.master_data, 'Date of Course')
                 self.master_data = self.clean_numeric_columns(self.master_data)
+                encode_categories(self.master_data, ['Tutor Name'])
                 st.success(f"✅ Master data: {len(self.master_data):,} records")
                 success = True
         
@@ -654,24 +793,16 @@ class QTSAnalytics:
         if rating_col not in self.data.columns:
             return None
         
-        trainer_stats = []
-        for trainer in self.data[trainer_col].unique():
-            if pd.notna(trainer):
-                df_trainer = self.data[self.data[trainer_col] == trainer]
-                if len(df_trainer) >= 1:  # Show all trainers, not just 3+
-                    avg_rating = pd.to_numeric(df_trainer[rating_col], errors='coerce').mean()
-                    if pd.notna(avg_rating):
-                        trainer_stats.append({
-                            'Trainer': str(trainer),
-                            'Rating': avg_rating,
-                            'Sessions': len(df_trainer),
-                            'Color': get_trainer_color(str(trainer))
-                        })
-        
-        if not trainer_stats:
+        # One grouped pass over the ratings; all trainers are shown, not just 3+
+        grouped = self.data.groupby(trainer_col, observed=True, sort=False)[rating_col]
+        df_stats = pd.DataFrame({'Rating': grouped.mean(), 'Sessions': grouped.size()}).dropna(subset=['Rating'])
+        
+        if df_stats.empty:
             return None
         
-        df_stats = pd.DataFrame(trainer_stats).sort_values('Rating', ascending=False)
+        df_stats['Trainer'] = df_stats.index.map(str)
+        df_stats['Color'] = df_stats['Trainer'].map(get_trainer_color)
+        df_stats = df_stats.sort_values('Rating', ascending=False)
         
         fig = go.Figure()
         
@@ -715,7 +846,7 @@ class QTSAnalytics:
             return None
         
         df = self.data[['Date of Course', rating_col]].copy()
-        df['Rating'] = pd.to_numeric(df[rating_col], errors='coerce')
+        df['Rating'] = df[rating_col]
         df = df.dropna()
         
         if len(df) < 2:
@@ -875,6 +1006,9 @@ class QTSAnalytics:
 # ============================================================================
 
 def main():
+    # Start probing Ollama now so its status is known by the time insights are drawn
+    get_ollama_health()
+    
     # Premium Header
     st.markdown("""
         <div class="premium-header">
@@ -891,6 +1025,15 @@ def main():
         master_file = st.file_uploader("Master Data", type=['xlsx', 'xls'], key='master')
         
         process_button = st.button("🔄 Process Data", use_container_width=True)
+        
+        cache_stats = get_ingest_cache().stats()
+        if cache_stats['enabled']:
+            st.caption(f"💾 Ingest cache: {cache_stats['hits']} hit(s), {cache_stats['misses']} miss(es), "
+                       f"{cache_stats['size_mb']:.1f} of {cache_stats['max_mb']:.0f} MB used")
+        llm_stats = get_response_cache().stats()
+        if llm_stats['enabled']:
+            st.caption(f"🤖 AI response cache: {llm_stats['entries']} stored insight(s), "
+                       f"{llm_stats['hits']} hit(s), {llm_stats['misses']} miss(es)")
     
     if not process_button:
         if not delegate_file:
@@ -898,8 +1041,8 @@ def main():
         return
     
     # Initialize processors
-    processor = QTSDataProcessor()
-    ai_engine = AIInsightsEngine()
+    processor = QTSDataProcessor(cache=get_ingest_cache())
+    ai_engine = AIInsightsEngine(cache=get_response_cache(), session=get_http_session(), health=get_ollama_health())
     
     # Load data
     if not processor.load_data(delegate_file, partner_file, master_file):
@@ -962,15 +1105,12 @@ def main():
     # AI Summary
     if ai_engine.available:
         st.markdown("#### 🤖 AI Executive Summary")
-        with st.spinner("Generating insights..."):
-            summary = ai_engine.generate_summary_insight(kpis, processor.delegate_data)
-            st.markdown(f"""
-                <div class="insight-container" style="border-left-color: {BRAND_COLOR};">
-                    <div class="insight-content">
-                        {summary}
-                    </div>
-                </div>
-            """, unsafe_allow_html=True)
+        summary_slot = st.empty()
+        render_executive_summary(summary_slot, "Generating insights...")
+        summary = ai_engine.generate_summary_insight(
+            kpis, processor.delegate_data, on_token=lambda text: render_executive_summary(summary_slot, text + " ▌")
+        )
+        render_executive_summary(summary_slot, summary)
     
     # Tabs
     tab1, tab2, tab3, tab4, tab5 = st.tabs(["📊 Charts", "⭐ Trainers", "🤝 Partner", "📈 Advanced", "📋 Data"])
@@ -1020,25 +1160,31 @@ def main():
                 break
         
         if trainer_col:
-            trainers = sorted([t for t in processor.delegate_data[trainer_col].unique() if pd.notna(t)])
+            # Rows sorted by trainer once; each trainer's rows are a zero-copy slice
+            trainer_rows, trainer_slices = group_slices(processor.delegate_data, trainer_col)
+            trainers = sorted(trainer_slices)
             
             rating_col = 'Please give the course a rating out of 5'
             
+            # Sub-metric and rating means for every trainer in one grouped pass
+            metric_cols = dict(processor.metric_columns)
+            if rating_col in processor.delegate_data.columns:
+                metric_cols['overall'] = rating_col
+            scores = processor.delegate_data[list(dict.fromkeys(metric_cols.values()))]
+            trainer_means = scores.groupby(processor.delegate_data[trainer_col], observed=True, sort=False).mean()
+            
+            # Profiles awaiting an AI summary: name -> (placeholder, color, metrics, comments)
+            pending = {}
+            
             for trainer_name in trainers:
-                df_trainer = processor.delegate_data[processor.delegate_data[trainer_col] == trainer_name]
+                df_trainer = trainer_rows.iloc[trainer_slices[trainer_name]]
                 
                 if len(df_trainer) >= 3:
                     color = get_trainer_color(trainer_name)
                     
-                    # Calculate metrics
-                    metrics = {}
-                    for metric_key in ['knowledge', 'adaptability', 'feedback', 'guidance']:
-                        cols = [col for col in df_trainer.columns if metric_key.lower() in col.lower()]
-                        if cols:
-                            metrics[metric_key] = pd.to_numeric(df_trainer[cols[0]], errors='coerce').mean()
-                    
-                    if rating_col in df_trainer.columns:
-                        metrics['overall'] = pd.to_numeric(df_trainer[rating_col], errors='coerce').mean()
+                    metrics = {key: trainer_means.at[trainer_name, col] for key, col in metric_cols.items()}
+                    if 'overall' in metrics:
+                        metrics['overall'] = float(metrics['overall'])
                     
                     performance = get_performance_level(metrics.get('overall', 0))
                     perf_theme = PERFORMANCE_THEMES.get(performance, PERFORMANCE_THEMES['Excellent'])
@@ -1067,18 +1213,9 @@ def main():
                     if ai_engine.available:
                         comments = df_trainer[feedback_col].dropna().unique().tolist() if feedback_col else []
                         if comments or metrics:
-                            with st.spinner(f"Analyzing {trainer_name}..."):
-                                summary = ai_engine.generate_personalized_trainer_summary(trainer_name, metrics, comments)
-                                st.markdown(f"""
-                                    <div class="insight-container" style="border-left-color: {color};">
-                                        <div class="insight-title" style="color: {color};">
-                                            ✨ Trainer Profile
-                                        </div>
-                                        <div class="insight-content">
-                                            {summary}
-                                        </div>
-                                    </div>
-                                """, unsafe_allow_html=True)
+                            profile_slot = st.empty()
+                            render_trainer_profile(profile_slot, color, f"Analyzing {trainer_name}...")
+                            pending[trainer_name] = (profile_slot, color, metrics, comments)
                     
                     # Feedback highlights
                     if feedback_col:
@@ -1102,6 +1239,20 @@ def main():
                             st.markdown('</div>', unsafe_allow_html=True)
                     
                     st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
+            
+            # Request every profile at once (no more than Ollama serves in parallel); tokens stream into each card
+            tasks = {
+                name: functools.partial(ai_engine.generate_personalized_trainer_summary, name, metrics, comments)
+                for name, (_, _, metrics, comments) in pending.items()
+            }
+            concurrency = request_concurrency(AI_CONCURRENCY, os.getenv('OLLAMA_NUM_PARALLEL'))
+            for trainer_name, summary, done, error in stream_concurrently(tasks, concurrency):
+                profile_slot, color, metrics, comments = pending[trainer_name]
+                if error is not None:
+                    summary = ai_engine._fallback_trainer_summary(trainer_name, metrics, comments)
+                render_trainer_profile(profile_slot, color, summary if done else summary + " ▌")
+            if pending and latency_caption(ai_engine.timings):
+                st.caption(latency_caption(ai_engine.timings))
     
     with tab3:
         st.markdown("### 🤝 Partner Feedback")